@@ -1,6 +1,18 @@
 from __future__ import print_function
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
 import unittest
 import thanosdb
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from thanosdb import thanosdb
 
 
@@ -98,5 +110,899 @@ class TestClass(unittest.TestCase):
         self.db.drem('dict')
 
 
+class TestSlowlog(unittest.TestCase):
+
+    def setUp(self):
+        self.db = thanosdb.load('tests.db', auto_dump=False, sig=False)
+
+    def test_slowlog_records_over_threshold(self):
+        self.db.slowlog_threshold = 0
+        self.db.set('key', 'value')
+        entry = self.db.slowlog_get(1)[0]
+        assert entry.command == 'set'
+        assert entry.key == 'key'
+        assert entry.arg_sizes == [5]
+        assert self.db.slowlog_len() == 1
+        self.db.slowlog_reset()
+        assert self.db.slowlog_len() == 0
+
+    def test_slowlog_disabled(self):
+        self.db.slowlog_threshold = None
+        self.db.set('key', 'value')
+        assert self.db.slowlog_len() == 0
+
+    def test_slowlog_max_len(self):
+        self.db.slowlog_threshold = 0
+        self.db.slowlog_max_len = 2
+        for i in range(5):
+            self.db.set('key', i)
+        assert [e.id for e in self.db.slowlog_get()] == [4, 3]
+
+    def test_hooks(self):
+        calls = []
+        hook = self.db.add_hook(
+            lambda name, args, kwargs: calls.append(('before', name)),
+            lambda name, args, kwargs, duration: calls.append(('after', name)))
+        self.db.get('key')
+        assert calls == [('before', 'get'), ('after', 'get')]
+        assert self.db.remove_hook(hook) is True
+        self.db.get('key')
+        assert len(calls) == 2
+        assert self.db.remove_hook(hook) is False
+
+    def test_nested_calls_not_recorded(self):
+        calls = []
+        self.db.add_hook(
+            lambda name, args, kwargs: calls.append(('before', name)),
+            lambda name, args, kwargs, duration: calls.append(('after', name)))
+        self.db.slowlog_threshold = 0
+        self.db.dadd('stones', ('Soul Stone', 'Vormir'))
+        assert calls == [('before', 'dadd'), ('after', 'dadd')]
+        assert [e.command for e in self.db.slowlog_get()] == ['dadd']
+
+
+class TestKeyIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.db = thanosdb.load('tests.db', auto_dump=False, sig=False)
+        for key in ['session:3', 'user:1', 'session:1', 'alpha', 'session:2']:
+            self.db.set(key, 'value')
+
+    def test_scan(self):
+        cursor, keys = self.db.scan(0, match='session:*', count=2)
+        assert keys == ['session:1', 'session:2']
+        cursor, keys = self.db.scan(cursor, match='session:*', count=2)
+        assert keys == ['session:3']
+        assert cursor == 0
+
+    def test_scan_all(self):
+        cursor, found = 0, []
+        while True:
+            cursor, keys = self.db.scan(cursor, count=2)
+            found.extend(keys)
+            if cursor == 0:
+                break
+        assert found == sorted(self.db.getall())
+
+    def test_count_below_one(self):
+        with self.assertRaises(ValueError):
+            self.db.scan(0, count=0)
+        with self.assertRaises(ValueError):
+            list(self.db.iter_range(count=0))
+
+    def test_iter_prefix(self):
+        self.db.rem('session:2')
+        self.db.lcreate('session:0')
+        assert list(self.db.iter_prefix('session:', count=1)) == [
+            'session:0', 'session:1', 'session:3']
+
+    def test_iter_range(self):
+        assert list(self.db.iter_range('b', 'u')) == [
+            'session:1', 'session:2', 'session:3']
+        self.db.deldb()
+        assert list(self.db.iter_range()) == []
+
+    def test_many_keys_random_order(self):
+        self.db.deldb()
+        keys = ['key:{:05d}'.format(i) for i in range(5000)]
+        shuffled = keys[:]
+        random.shuffle(shuffled)
+        for key in shuffled:
+            self.db.set(key, 1)
+        for key in shuffled[::3]:
+            self.db.rem(key)
+        expected = sorted(set(keys) - set(shuffled[::3]))
+        assert list(self.db.iter_prefix('key:', count=7)) == expected
+        cursor, found = 0, []
+        while True:
+            cursor, batch = self.db.scan(cursor, match='key:*', count=300)
+            found.extend(batch)
+            if cursor == 0:
+                break
+        assert found == expected
+
+
+class TestSecondaryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.db = thanosdb.load('tests.db', auto_dump=False, sig=False)
+        self.db.set('thor', {'status': 'active', 'team': 'avengers'})
+        self.db.dadd('ironman', ('status', 'retired'))
+        self.db.create_index('status')
+
+    def test_find(self):
+        self.db.dadd('hulk', ('status', 'active'))
+        assert sorted(self.db.find('status', 'active')) == ['hulk', 'thor']
+        assert self.db.find('status', 'retired') == ['ironman']
+        assert self.db.find('status', 'missing') == []
+
+    def test_find_without_index(self):
+        with self.assertRaises(KeyError):
+            self.db.find('team', 'avengers')
+
+    def test_index_updates(self):
+        self.db.dadd('thor', ('status', 'retired'))
+        assert sorted(self.db.find('status', 'retired')) == ['ironman', 'thor']
+        self.db.dpop('ironman', 'status')
+        self.db.rem('thor')
+        assert self.db.find('status', 'retired') == []
+        self.db.set('vision', {'status': 'active'})
+        self.db.dcreate('merge')
+        self.db.dmerge('merge', 'vision')
+        assert sorted(self.db.find('status', 'active')) == ['merge', 'vision']
+        self.db.drem('vision')
+        assert self.db.find('status', 'active') == ['merge']
+        self.db.deldb()
+        assert self.db.find('status', 'active') == []
+
+    def test_drop_index(self):
+        assert self.db.create_index('status') is False
+        assert self.db.drop_index('status') is True
+        assert self.db.drop_index('status') is False
+
+
+class TestCounters(unittest.TestCase):
+
+    def setUp(self):
+        self.db = thanosdb.load('tests.db', auto_dump=False, sig=False)
+
+    def test_incr_decr(self):
+        assert self.db.incr('snaps') == 1
+        assert self.db.incrby('snaps', 5) == 6
+        assert self.db.decr('snaps') == 5
+        assert self.db.get('snaps') == 5
+        assert list(self.db.iter_prefix('snaps')) == ['snaps']
+
+    def test_incr_not_integer(self):
+        self.db.set('name', 'Thanos')
+        with self.assertRaises(TypeError):
+            self.db.incr('name')
+        with self.assertRaises(TypeError):
+            self.db.incrby('snaps', 1.5)
+        assert not self.db.exists('snaps')
+
+    def test_incrbyfloat(self):
+        self.db.set('power', 1)
+        assert self.db.incrbyfloat('power', 0.5) == 1.5
+        assert self.db.incrbyfloat('power', 1) == 2.5
+
+    def test_dincrby(self):
+        self.db.create_index('count')
+        assert self.db.dincrby('stones', 'count') == 1
+        assert self.db.dincrby('stones', 'count', 5) == 6
+        assert self.db.dget('stones', 'count') == 6
+        assert self.db.find('count', 6) == ['stones']
+        assert self.db.find('count', 1) == []
+        self.db.set('snaps', 1)
+        self.db.set('avengers', ['Thor'])
+        for name in ('snaps', 'avengers'):
+            with self.assertRaises(TypeError):
+                self.db.dincrby(name, 'count')
+
+
+class TestTransaction(unittest.TestCase):
+
+    def setUp(self):
+        self.db = thanosdb.load('tests.db', auto_dump=False, sig=False)
+        self.db.lcreate('avengers')
+        self.db.lextend('avengers', ['Iron Man', 'Thor'])
+
+    def test_execute(self):
+        tx = self.db.multi()
+        tx.lpop('avengers', 0).ladd('retired', 'Iron Man').get('retired')
+        assert tx.execute() == ['Iron Man', True, ['Iron Man']]
+        assert self.db.get('avengers') == ['Thor']
+        assert tx.queue == []
+
+    def test_rollback(self):
+        self.db.create_index('status')
+        self.db.dadd('thor', ('status', 'active'))
+        tx = self.db.multi()
+        tx.lpop('avengers', 0).dadd('thor', ('status', 'retired'))
+        tx.set('new', 'key').lpop('avengers', 5)
+        with self.assertRaises(IndexError):
+            tx.execute()
+        assert self.db.get('avengers') == ['Iron Man', 'Thor']
+        assert self.db.exists('new') is False
+        assert list(self.db.iter_prefix('new')) == []
+        assert self.db.find('status', 'active') == ['thor']
+
+    def test_rollback_deldb(self):
+        tx = self.db.multi()
+        tx.ladd('avengers', 'Hulk').deldb().lpop('avengers', 0)
+        with self.assertRaises(KeyError):
+            tx.execute()
+        assert self.db.get('avengers') == ['Iron Man', 'Thor']
+
+    def test_rollback_in_place(self):
+        self.db.dadd('stones', ('Soul Stone', 'Vormir'))
+        self.db.dadd('more', ('Time Stone', 'Earth'))
+        self.db.dadd('more', ('Soul Stone', 'Titan'))
+        self.db.set('snaps', 1)
+        tx = self.db.multi()
+        tx.lextend('avengers', ['Hulk', 'Vision']).lpop('avengers', -1)
+        tx.lremvalue('avengers', 'Iron Man').lappend('avengers', 0, ' Odinson')
+        tx.dadd('stones', ('Mind Stone', 'Vision')).dincrby('stones', 'count')
+        tx.dpop('stones', 'Soul Stone').dmerge('stones', 'more')
+        tx.incr('snaps').ladd('new', 'value').rem('more')
+        tx.lpop('avengers', 10)
+        with self.assertRaises(IndexError):
+            tx.execute()
+        assert self.db.get('avengers') == ['Iron Man', 'Thor']
+        assert self.db.get('stones') == {'Soul Stone': 'Vormir'}
+        assert self.db.get('more') == {'Time Stone': 'Earth', 'Soul Stone': 'Titan'}
+        assert self.db.get('snaps') == 1
+        assert self.db.exists('new') is False
+
+    def test_commit_copies_nothing(self):
+        deepcopy = thanosdb.copy.deepcopy
+
+        def failing(value):
+            raise AssertionError('value was copied')
+        thanosdb.copy.deepcopy = failing
+        try:
+            tx = self.db.multi()
+            tx.lpop('avengers', 0).ladd('retired', 'Iron Man').ladd('avengers', 'Hulk')
+            assert tx.execute() == ['Iron Man', True, True]
+        finally:
+            thanosdb.copy.deepcopy = deepcopy
+        assert self.db.get('avengers') == ['Thor', 'Hulk']
+
+    def test_watch_conflict(self):
+        tx = self.db.multi('avengers')
+        self.db.ladd('avengers', 'Hulk')
+        tx.lpop('avengers', 0)
+        with self.assertRaises(thanosdb.WatchError):
+            tx.execute()
+        assert self.db.llen('avengers') == 3
+
+    def test_watch_deldb(self):
+        tx = self.db.multi('avengers')
+        self.db.deldb()
+        tx.lcreate('avengers')
+        with self.assertRaises(thanosdb.WatchError):
+            tx.execute()
+
+    def test_versions_only_for_watched_keys(self):
+        for i in range(100):
+            self.db.set('key:{}'.format(i), i)
+        assert self.db._versions == {}
+        tx = self.db.multi('key:1')
+        self.db.rem('key:1')
+        tx.set('key:1', 'again')
+        with self.assertRaises(thanosdb.WatchError):
+            tx.execute()
+        assert self.db._versions == {}
+        assert self.db._watchers == {}
+
+    def test_transaction_retry(self):
+        attempts = []
+
+        def move(tx):
+            attempts.append(1)
+            if len(attempts) == 1:
+                self.db.ladd('avengers', 'Hulk')
+            tx.lpop('avengers', 0)
+        assert self.db.transaction(move, 'avengers') == ['Iron Man']
+        assert len(attempts) == 2
+        with self.assertRaises(thanosdb.WatchError):
+            attempts[:] = []
+            self.db.transaction(move, 'avengers', retries=1)
+
+    def test_unknown_command(self):
+        with self.assertRaises(AttributeError):
+            self.db.multi().load('x.db', False)
+
+
+class TestSubscribe(unittest.TestCase):
+
+    def setUp(self):
+        self.db = thanosdb.load('tests.db', auto_dump=False, sig=False)
+
+    def test_events(self):
+        sub = self.db.subscribe('session:*')
+        self.db.set('session:1', 'data')
+        self.db.set('user:1', 'data')
+        self.db.ladd('session:2', 'data')
+        self.db.deldb()
+        assert list(sub.events) == [
+            thanosdb.Event('set', 'session:1'),
+            thanosdb.Event('ladd', 'session:2'),
+            thanosdb.Event('deldb', None)]
+        assert sub.get() == thanosdb.Event('set', 'session:1')
+        sub.close()
+        self.db.set('session:3', 'data')
+        assert len(sub.events) == 2
+        assert list(sub) == [
+            thanosdb.Event('ladd', 'session:2'), thanosdb.Event('deldb', None)]
+
+    def test_callback(self):
+        events = []
+        self.db.subscribe(callback=events.append)
+        self.db.dadd('thor', ('status', 'active'))
+        assert events == [thanosdb.Event('dadd', 'thor')]
+
+    def test_callback_error_logged(self):
+        def failing(event):
+            raise ValueError('can not handle')
+        self.db.subscribe(callback=failing)
+        with self.assertLogs('thanosdb.thanosdb', level='ERROR') as logs:
+            assert self.db.set('thor', 'Thor') is True
+        assert 'ValueError' in logs.output[0]
+
+    def test_bounded_queue(self):
+        sub = self.db.subscribe(maxlen=2)
+        for i in range(5):
+            self.db.incr('snaps')
+        assert len(sub.events) == 2
+        assert sub.dropped == 3
+        assert sub.get(timeout=0) is not None
+
+    def test_noop_writes(self):
+        sub = self.db.subscribe()
+        self.db.set('user', {'name': 'Thor'})
+        tx = self.db.multi('nope', 'user')
+        assert sub.get(timeout=0) == thanosdb.Event('set', 'user')
+        assert self.db.rem('nope') is False
+        assert self.db.pdel('user.prefs.theme') is False
+        assert self.db.pdel('nope.theme') is False
+        assert sub.get(timeout=0) is None
+        assert tx.set('user', 'Thor').execute() == [True]
+        assert self.db.rem('user') is True
+        assert sub.get(timeout=0) == thanosdb.Event('set', 'user')
+
+    def test_transaction_events(self):
+        sub = self.db.subscribe()
+        tx = self.db.multi()
+        tx.set('a', 1).lpop('missing', 0)
+        with self.assertRaises(KeyError):
+            tx.execute()
+        assert sub.get(timeout=0) is None
+        self.db.multi().set('a', 1).set('b', 2).execute()
+        assert [e.key for e in sub.events] == ['a', 'b']
+
+    def test_async_iteration(self):
+        sub = self.db.subscribe()
+
+        async def consume():
+            loop = asyncio.get_event_loop()
+            loop.call_later(0.01, self.db.set, 'key', 'value')
+            async for event in sub:
+                return event
+        loop = asyncio.new_event_loop()
+        try:
+            event = loop.run_until_complete(consume())
+        finally:
+            loop.close()
+        assert event == thanosdb.Event('set', 'key')
+
+
+class TestReplication(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.address = os.path.join(self.tmp, 'repl.sock')
+        self.db = thanosdb.load('tests.db', auto_dump=False, sig=False)
+        self.db.set('ironman', 'Tony Stark')
+        self.db.serve_replication(self.address, interval=0.05)
+        self.replica = thanosdb.follow(self.address, reconnect=0.05)
+        assert self.replica.synced.wait(5)
+
+    def tearDown(self):
+        self.replica.close()
+        self.db.stop_replication()
+        shutil.rmtree(self.tmp)
+
+    def wait_for_offset(self):
+        deadline = time.time() + 5
+        while self.replica.offset < self.db._repl_offset and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_initial_sync(self):
+        assert self.replica.get('ironman') == 'Tony Stark'
+        assert self.replica.lag() < 5
+
+    def test_stream(self):
+        self.db.ladd('avengers', 'Thor')
+        self.db.dadd('stones', ('Soul Stone', 'Vormir'))
+        self.db.multi().incr('snaps').rem('ironman').execute()
+        self.wait_for_offset()
+        assert self.replica.lget('avengers', 0) == 'Thor'
+        assert self.replica.dget('stones', 'Soul Stone') == 'Vormir'
+        assert self.replica.get('snaps') == 1
+        assert self.replica.exists('ironman') is False
+        assert self.replica.primary_offset == self.db._repl_offset
+
+    def test_unserializable_args(self):
+        self.db.lcreate('avengers')
+        self.db.lextend('avengers', (name for name in ['Thor', 'Hulk']))
+        with self.assertRaises(TypeError):
+            self.db.set('stones', {'Soul Stone'})
+        assert self.db.exists('stones') is False
+        self.wait_for_offset()
+        assert self.replica.lgetall('avengers') == ['Thor', 'Hulk']
+        assert self.db.lgetall('avengers') == ['Thor', 'Hulk']
+
+    def test_apply_error_resyncs(self):
+        apply = self.replica._apply
+
+        def failing(record):
+            if record[0] == 'cmd' and not failing.failed:
+                failing.failed = True
+                raise ValueError('can not apply')
+            apply(record)
+        failing.failed = False
+        self.replica._apply = failing
+        sub = self.replica.subscribe()
+        with self.assertLogs('thanosdb.thanosdb', level='ERROR') as logs:
+            self.db.set('thor', 'Thor Odinson')
+            assert sub.get(timeout=5) == thanosdb.Event('sync', None)
+        assert failing.failed
+        assert 'can not apply' in logs.output[0]
+        assert self.replica.get('thor') == 'Thor Odinson'
+
+    def test_transaction_args_encoded_before_write(self):
+        avengers = ['Thor']
+        self.db.multi().set('avengers', avengers).ladd('avengers', 'Hulk').execute()
+        tx = self.db.multi()
+        for i in range(20):
+            tx.set('key:{}'.format(i), i)
+        tx.execute()
+        self.wait_for_offset()
+        assert self.db.get('avengers') == ['Thor', 'Hulk']
+        assert self.replica.get('avengers') == ['Thor', 'Hulk']
+        assert self.replica.get('key:19') == 19
+
+    def test_read_only(self):
+        with self.assertRaises(RuntimeError):
+            self.replica.set('thor', 'Thor Odinson')
+        with self.assertRaises(RuntimeError):
+            self.replica.dump()
+
+    def test_resync(self):
+        sub = self.replica.subscribe()
+        self.db.stop_replication()
+        self.db.set('thor', 'Thor Odinson')
+        self.db.serve_replication(self.address, interval=0.05)
+        assert sub.get(timeout=5) == thanosdb.Event('sync', None)
+        assert self.replica.get('thor') == 'Thor Odinson'
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = thanosdb.load(os.path.join(self.tmp, 'tests.db'), False, False)
+        self.db.set('ironman', 'Tony Stark')
+        self.db.dadd('stones', ('Soul Stone', 'Vormir'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_publish_and_read(self):
+        assert self.db.publish_snapshot() == 1
+        snap = thanosdb.open_snapshot(self.db.loco + '.snap')
+        assert snap.get('ironman') == 'Tony Stark'
+        assert snap['stones'] == {'Soul Stone': 'Vormir'}
+        assert snap.get('thor') is False
+        assert bytes(snap.raw('ironman')) == b'\xaaTony Stark'
+        assert len(snap) == 2
+
+    def test_new_generation(self):
+        path = os.path.join(self.tmp, 'shared.snap')
+        self.db.publish_snapshot(path)
+        snap = thanosdb.open_snapshot(path, check_interval=None)
+        view = snap.raw('ironman')
+        self.db.set('ironman', 'Iron Man')
+        assert self.db.publish_snapshot(path) == 2
+        assert snap.get('ironman') == 'Tony Stark'
+        assert snap.refresh() is True
+        assert snap.generation == 2
+        assert snap.get('ironman') == 'Iron Man'
+        assert bytes(view) == b'\xaaTony Stark'
+        assert snap.refresh() is False
+
+
+class TestPath(unittest.TestCase):
+
+    def setUp(self):
+        self.db = thanosdb.load('tests.db', auto_dump=False, sig=False)
+        self.db.set('user', {'42': {'prefs': {'theme': 'light'}, 'tags': ['hero']}})
+
+    def test_pget(self):
+        assert self.db.pget('user.42.prefs.theme') == 'light'
+        assert self.db.pget(['user', '42', 'tags', 0]) == 'hero'
+        assert self.db.pget('user.42.tags.-1') == 'hero'
+        assert self.db.pget('user.42.missing.theme') is False
+        assert self.db.pget('user.42.tags.x') is False
+
+    def test_pset(self):
+        self.db.pset('user.42.prefs.theme', 'dark')
+        self.db.pset('user.7.prefs.theme', 'dark')
+        self.db.pset('settings.color', 'red')
+        assert self.db.get('user')['42']['prefs'] == {'theme': 'dark'}
+        assert self.db.get('user')['7'] == {'prefs': {'theme': 'dark'}}
+        assert self.db.get('settings') == {'color': 'red'}
+        assert list(self.db.iter_prefix('settings')) == ['settings']
+
+    def test_pdel(self):
+        assert self.db.pdel('user.42.prefs.theme') is True
+        assert self.db.pdel('user.42.prefs.theme') is False
+        assert self.db.pdel('user.7.prefs') is False
+        assert self.db.get('user') == {'42': {'prefs': {}, 'tags': ['hero']}}
+        assert self.db.pdel('user') is True
+        assert list(self.db.iter_prefix('user')) == []
+
+    def test_pappend_pincr(self):
+        self.db.pappend('user.42.tags', 'avenger')
+        self.db.pappend('user.42.prefs.theme', '-blue')
+        assert self.db.pget('user.42.tags') == ['hero', 'avenger']
+        assert self.db.pget('user.42.prefs.theme') == 'light-blue'
+        assert self.db.pincr('user.42.visits') == 1
+        assert self.db.pincr('user.42.visits', 2.5) == 3.5
+        self.db.set('scores', [1, 2])
+        assert self.db.pincr('scores.1', 3) == 5
+        assert self.db.pincr('scores.-1') == 6
+        with self.assertRaises(IndexError):
+            self.db.pincr('scores.2')
+
+    def test_failed_write_creates_nothing(self):
+        with self.assertRaises(KeyError):
+            self.db.pappend('new.a.b', 'x')
+        assert self.db.exists('new') is False
+        assert list(self.db.iter_prefix('new')) == []
+        with self.assertRaises(KeyError):
+            self.db.pappend('user.42.prefs.font.size', 'x')
+        assert self.db.get('user')['42']['prefs'] == {'theme': 'light'}
+
+    def test_index_and_events(self):
+        self.db.create_index('status')
+        sub = self.db.subscribe('user')
+        self.db.pset('user.status', 'active')
+        assert self.db.find('status', 'active') == ['user']
+        self.db.pdel('user.status')
+        assert self.db.find('status', 'active') == []
+        assert [e.key for e in sub.events] == ['user', 'user']
+        tx = self.db.multi('user')
+        self.db.pincr('user.42.visits')
+        tx.pset('user.42.prefs.theme', 'dark')
+        with self.assertRaises(thanosdb.WatchError):
+            tx.execute()
+
+
+class TestBinary(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.location = os.path.join(self.tmp, 'tests.db')
+        self.db = thanosdb.load(self.location, False, False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_bytes_roundtrip(self):
+        self.db.set('blob', b'\x00\xff\xfe')
+        self.db.set('view', memoryview(b'snap'))
+        self.db.set('name', 'Thanos')
+        self.db.dump()
+        db = thanosdb.load(self.location, False, False)
+        assert db.get('blob') == b'\x00\xff\xfe'
+        assert db.get('view') == b'snap'
+        assert db.get('name') == 'Thanos'
+
+    def test_snapshot_view(self):
+        self.db.set('blob', b'\x00\xff\xfe')
+        self.db.publish_snapshot()
+        snap = thanosdb.open_snapshot(self.location + '.snap')
+        view = snap.view('blob')
+        assert isinstance(view, memoryview)
+        assert view == b'\x00\xff\xfe'
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_ndarray(self):
+        array = numpy.arange(12, dtype='<f4').reshape(3, 4)
+        self.db.set('vector', array)
+        self.db.set('scalar', numpy.int64(7))
+        self.db.dump()
+        db = thanosdb.load(self.location, False, False)
+        assert db.get('vector').dtype == array.dtype
+        assert (db.get('vector') == array).all()
+        assert db.get('scalar') == 7
+        self.db.publish_snapshot()
+        snap = thanosdb.open_snapshot(self.location + '.snap')
+        view = snap.view('vector')
+        assert (view == array).all()
+        assert view.flags.writeable is False
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_ndarray_structured(self):
+        dtype = numpy.dtype([('id', '<i4'), ('pos', '<f8', (2,))], align=True)
+        array = numpy.zeros(3, dtype=dtype)
+        array['id'] = [1, 2, 3]
+        array['pos'][1] = [0.5, 1.5]
+        self.db.set('points', array)
+        self.db.dump()
+        db = thanosdb.load(self.location, False, False)
+        assert db.get('points').dtype == dtype
+        assert (db.get('points') == array).all()
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_ndarray_object_dtype(self):
+        self.db.set('objects', numpy.array([{'a': 1}, None], dtype=object))
+        with self.assertRaises(TypeError):
+            self.db.dump()
+
+
+class TestMemoryUsage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.location = os.path.join(self.tmp, 'tests.db')
+        self.db = thanosdb.load(self.location, False, False)
+        self.db.set('ironman', 'Tony Stark')
+        self.db.set('thor', 'Thor')
+        self.db.lcreate('avengers')
+        self.db.lextend('avengers', ['Thor', 'Hulk', 'Vision'])
+        self.db.dadd('stones', ('Soul Stone', 'Vormir'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_memory_usage(self):
+        usage = self.db.memory_usage('avengers')
+        assert usage.type == 'list'
+        assert usage.length == 3
+        assert usage.encoded == len(b'\x93\xa4Thor\xa4Hulk\xa6Vision')
+        assert usage.size > usage.encoded
+        assert self.db.memory_usage('hulk') is False
+
+    def test_bigkeys(self):
+        report = self.db.bigkeys(top=1)
+        assert sorted(report) == ['dict', 'list', 'str']
+        assert [u.key for u in report['str']] == ['ironman']
+        assert len(self.db.bigkeys(samples=2).get('str', [])) <= 2
+
+    def test_analyze(self):
+        self.db.dump()
+        report = thanosdb.analyze(self.location, top=1)
+        expected = self.db.bigkeys(top=1)
+        assert sorted(report) == sorted(expected)
+        for kind in report:
+            assert [(u.key, u.length, u.encoded) for u in report[kind]] == [
+                (u.key, u.length, u.encoded) for u in expected[kind]]
+
+
+class TestImportExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.location = os.path.join(self.tmp, 'tests.db')
+        db = thanosdb.load(self.location, False, False)
+        db.set('ironman', 'Tony Stark')
+        db.dump()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def test_import_jsonl(self):
+        with open(self.path('heroes.jsonl'), 'w') as f:
+            f.write('{"key": "thor", "value": "Thor Odinson"}\n\n')
+            f.write('{"key": "ironman", "value": {"suit": "Mark 85"}}\n')
+        count = thanosdb.import_file(self.location, self.path('heroes.jsonl'), workers=2, chunksize=1)
+        assert count == 2
+        db = thanosdb.load(self.location, False, False)
+        assert db.get('thor') == 'Thor Odinson'
+        assert db.get('ironman') == {'suit': 'Mark 85'}
+
+    def test_import_csv(self):
+        with open(self.path('heroes.csv'), 'w') as f:
+            f.write('key,value\nthor,"""Thor Odinson"""\nhulk,"""Bruce, Banner"""\n')
+            f.write('snaps,1\nloki,God of Mischief\n')
+        assert thanosdb.import_file(self.location, self.path('heroes.csv'), workers=0) == 4
+        db = thanosdb.load(self.location, False, False)
+        assert db.get('hulk') == 'Bruce, Banner'
+        assert db.get('snaps') == 1
+        assert db.get('loki') == 'God of Mischief'
+        assert db.get('ironman') == 'Tony Stark'
+
+    def test_export_import_roundtrip(self):
+        db = thanosdb.load(self.location, False, False)
+        db.dadd('stones', ('Soul Stone', 'Vormir'))
+        db.dump()
+        for name in ('out.jsonl', 'out.msgpack', 'out.csv'):
+            assert thanosdb.export_file(self.location, self.path(name)) == 2
+        new = self.path('new.db')
+        assert thanosdb.import_file(new, self.path('out.msgpack')) == 2
+        assert thanosdb.import_file(new, self.path('out.jsonl'), workers=0) == 2
+        db = thanosdb.load(new, False, False)
+        assert db.get('stones') == {'Soul Stone': 'Vormir'}
+        with open(self.path('out.csv')) as f:
+            assert f.read().splitlines()[-1] == 'stones,"{""Soul Stone"": ""Vormir""}"'
+
+    def test_csv_roundtrip(self):
+        db = thanosdb.load(self.location, False, False)
+        db.set('snaps', 1)
+        db.set('year', '2018')
+        db.dadd('stones', ('Soul Stone', 'Vormir'))
+        db.dump()
+        assert thanosdb.export_file(self.location, self.path('out.csv')) == 4
+        new = self.path('new.db')
+        assert thanosdb.import_file(new, self.path('out.csv'), workers=0) == 4
+        db = thanosdb.load(new, False, False)
+        assert db.get('ironman') == 'Tony Stark'
+        assert db.get('snaps') == 1
+        assert db.get('year') == '2018'
+        assert db.get('stones') == {'Soul Stone': 'Vormir'}
+
+    def test_reimport_replaces_keys(self):
+        with open(self.path('heroes.jsonl'), 'w') as f:
+            f.write('{"key": "ironman", "value": "Mark 1"}\n')
+            f.write('{"key": "thor", "value": "Thor"}\n')
+            f.write('{"key": "ironman", "value": "Mark 85"}\n')
+        for _ in range(2):
+            assert thanosdb.import_file(
+                self.location, self.path('heroes.jsonl'), workers=0, chunksize=2) == 3
+        assert thanosdb.export_file(self.location, self.path('out.jsonl')) == 2
+        report = thanosdb.analyze(self.location)
+        assert sorted(usage.key for usage in report['str']) == ['ironman', 'thor']
+        db = thanosdb.load(self.location, False, False)
+        assert db.get('ironman') == 'Mark 85'
+        assert db.totalkeys() == 2
+
+    def test_export_binary(self):
+        db = thanosdb.load(self.location, False, False)
+        db.set('blob', b'\x00\xff')
+        db.dump()
+        with open(self.path('out.jsonl'), 'w') as f:
+            f.write('previous export\n')
+        for name in ('out.jsonl', 'out.csv'):
+            with self.assertRaises(TypeError):
+                thanosdb.export_file(self.location, self.path(name))
+        assert sorted(os.listdir(self.tmp)) == ['out.jsonl', 'tests.db']
+        with open(self.path('out.jsonl')) as f:
+            assert f.read() == 'previous export\n'
+        assert thanosdb.export_file(self.location, self.path('out.msgpack')) == 2
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            thanosdb.export_file(self.location, self.path('out.txt'))
+
+
+class TestCompact(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.location = os.path.join(self.tmp, 'tests.db')
+        self.db = thanosdb.load(self.location, False, False, compact=True)
+        self.db.compact_max_entries = 4
+        self.db.compact_array_min = 8
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_small_dict(self):
+        self.db.dadd('stones', ('Soul Stone', 'Vormir'))
+        assert isinstance(self.db.db['stones'], thanosdb._PackedDict)
+        assert self.db.dget('stones', 'Soul Stone') == 'Vormir'
+        assert self.db.get('stones') == {'Soul Stone': 'Vormir'}
+        assert self.db.dpop('stones', 'Soul Stone') == 'Vormir'
+        assert self.db.totalkeys('stones') == 0
+        self.db.dadd('stones', ('nested', {'a': 1}))
+        assert type(self.db.db['stones']) is dict
+
+    def test_dict_grows(self):
+        for i in range(5):
+            self.db.dincrby('counts', str(i))
+        assert type(self.db.db['counts']) is dict
+        assert self.db.dgetall('counts') == dict.fromkeys('01234', 1)
+
+    def test_numeric_list(self):
+        self.db.lcreate('scores')
+        self.db.lextend('scores', [1, 2, 3])
+        assert isinstance(self.db.db['scores'], thanosdb._PackedList)
+        self.db.lextend('scores', range(4, 10))
+        assert isinstance(self.db.db['scores'], thanosdb.array)
+        self.db.ladd('scores', 10)
+        self.db.lappend('scores', 0, 10)
+        assert self.db.lget('scores', 0) == 11
+        assert self.db.lpop('scores', 1) == 2
+        assert self.db.lexists('scores', 10) is True
+        self.db.ladd('scores', 1.5)
+        assert type(self.db.db['scores']) is list
+        assert self.db.lgetall('scores')[-1] == 1.5
+
+    def test_set_path_and_index(self):
+        self.db.create_index('status')
+        self.db.set('thor', {'status': 'active'})
+        assert isinstance(self.db.db['thor'], thanosdb._PackedDict)
+        assert self.db.find('status', 'active') == ['thor']
+        self.db.pset('thor.prefs.theme', 'dark')
+        assert self.db.pget('thor.prefs.theme') == 'dark'
+        self.db.pdel('thor.prefs')
+        assert isinstance(self.db.db['thor'], thanosdb._PackedDict)
+        tx = self.db.multi()
+        tx.dadd('thor', ('status', 'retired')).lpop('missing', 0)
+        with self.assertRaises(KeyError):
+            tx.execute()
+        assert self.db.find('status', 'active') == ['thor']
+
+    def test_dump_and_load(self):
+        self.db.dadd('stones', ('Soul Stone', 'Vormir'))
+        self.db.lcreate('scores')
+        self.db.lextend('scores', range(200))
+        self.db.dump()
+        plain = thanosdb.load(self.location, False, False)
+        assert plain.get('stones') == {'Soul Stone': 'Vormir'}
+        assert plain.get('scores') == list(range(200))
+        db = thanosdb.load(self.location, False, False, compact=True)
+        assert isinstance(db.db['scores'], thanosdb.array)
+        assert db.memory_usage('scores').type == 'list'
+
+    def test_packed_decodes_once(self):
+        packed = thanosdb._PackedList([1, 2, 3, 2])
+        mapping = thanosdb._PackedDict({'a': 1, 'b': 2})
+        unpackb, calls = thanosdb._unpackb, []
+
+        def counting(data):
+            calls.append(data)
+            return unpackb(data)
+        thanosdb._unpackb = counting
+        try:
+            assert list(packed) == [1, 2, 3, 2]
+            assert list(reversed(packed)) == [2, 3, 2, 1]
+            assert 3 in packed
+            assert packed.index(2, 2) == 3
+            assert packed.count(2) == 2
+            assert sorted(mapping.items()) == [('a', 1), ('b', 2)]
+            assert sorted(mapping.values()) == [1, 2]
+            assert sorted(mapping.keys()) == ['a', 'b']
+            mapping.update(thanosdb._PackedDict({'c': 3}), d=4)
+        finally:
+            thanosdb._unpackb = unpackb
+        assert len(calls) == 10
+        assert mapping == {'a': 1, 'b': 2, 'c': 3, 'd': 4}
+
+    def test_transparent(self):
+        results = []
+        for compact in (False, True):
+            db = thanosdb.load(self.location, False, False, compact=compact)
+            db.compact_array_min = 8
+            db.set('small', [1, 2, 3])
+            db.append('small', [4])
+            db.lcreate('scores')
+            db.lextend('scores', range(20))
+            db.dadd('stones', ('Soul Stone', 'Vormir'))
+            results.append([
+                db.get('small'), db.get('small') + [5], db.get('scores'),
+                db.lget('scores', slice(0, 3)), db.dgetall('stones'),
+                list(db.dkeys('stones')), list(db.dvals('stones')),
+                json.dumps([db.get('small'), db['stones'], db.pget('scores')]),
+                [type(db.get(key)) for key in ('small', 'scores', 'stones')]])
+        assert results[0] == results[1]
+
+
 if __name__ == "__main__":
     unittest.main()
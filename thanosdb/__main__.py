@@ -0,0 +1,77 @@
+'''Command line tools for ThanosDB files.
+
+:Example:
+
+.. code-block:: shell
+
+    python -m thanosdb analyze avengers.db --top 5
+    python -m thanosdb import avengers.db heroes.jsonl --workers 4
+    python -m thanosdb export avengers.db heroes.csv
+'''
+import argparse
+
+from thanosdb import thanosdb
+
+
+def _analyze(args):
+    '''Print the bigkeys report of a db file'''
+    report = thanosdb.analyze(args.file, args.top)
+    for kind in sorted(report):
+        print('# {}'.format(kind))
+        for usage in report[kind]:
+            print('{}\tlength={}\tsize={}\tencoded={}'.format(
+                usage.key, usage.length, usage.size, usage.encoded))
+
+
+def _import(args):
+    '''Import records from a file into a db file'''
+    count = thanosdb.import_file(
+        args.file, args.source, args.format, args.workers, args.chunksize)
+    print('Imported {} records.'.format(count))
+
+
+def _export(args):
+    '''Export all records of a db file'''
+    count = thanosdb.export_file(args.file, args.target, args.format)
+    print('Exported {} records.'.format(count))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m thanosdb')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    analyze = commands.add_parser(
+        'analyze', help='report the biggest keys of a db file by type')
+    analyze.add_argument('file', help='location of msgpack database file')
+    analyze.add_argument('--top', type=int, default=10,
+                         help='number of keys reported per type')
+    analyze.set_defaults(func=_analyze)
+
+    formats = ('jsonl', 'csv', 'msgpack')
+    imp = commands.add_parser(
+        'import', help='stream records from jsonl, csv or msgpack into a db file')
+    imp.add_argument('file', help='location of msgpack database file')
+    imp.add_argument('source', help='file of records to import')
+    imp.add_argument('--format', choices=formats,
+                     help='format of source, guessed from its extension by default')
+    imp.add_argument('--workers', type=int, default=None,
+                     help='number of encoding processes, one per CPU by default')
+    imp.add_argument('--chunksize', type=int, default=1000,
+                     help='number of records sent to a process at a time')
+    imp.set_defaults(func=_import)
+
+    exp = commands.add_parser(
+        'export', help='stream all records of a db file to jsonl, csv or msgpack')
+    exp.add_argument('file', help='location of msgpack database file')
+    exp.add_argument('target', help='file to write the records to')
+    exp.add_argument('--format', choices=formats,
+                     help='format of target, guessed from its extension by default')
+    exp.set_defaults(func=_export)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
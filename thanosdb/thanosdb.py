@@ -1,14 +1,1372 @@
+import asyncio
+import copy
+import csv
+import functools
+import heapq
+import json
+import logging
+import mmap
+import multiprocessing
 import os
+import random
+import shutil
 import signal
+import socket
+import struct
 import sys
+import time
 
-from threading import Thread
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque, namedtuple
+from collections.abc import Iterator, MutableMapping, MutableSequence
+from fnmatch import fnmatchcase
+from threading import Condition, Event as ThreadEvent, RLock, Thread, local
 
 import msgpack
 
-def load(location, auto_dump, sig=True):
+try:
+    import numpy
+    from numpy.lib import format as npy_format
+except ImportError:
+    numpy = None
+
+_log = logging.getLogger(__name__)
+
+SlowlogEntry = namedtuple(
+    'SlowlogEntry', ['id', 'timestamp', 'duration', 'command', 'key', 'arg_sizes'])
+Event = namedtuple('Event', ['command', 'key'])
+KeyUsage = namedtuple('KeyUsage', ['key', 'type', 'length', 'size', 'encoded'])
+
+
+_NDARRAY_EXT = 1
+_NDARRAY_HEADER = struct.Struct('<H')  # size of the msgpack [dtype, shape] header
+
+
+def _default(obj):
+    '''Encode values msgpack has no native type for'''
+    if isinstance(obj, (_PackedList, _PackedDict)):
+        return obj._plain()
+    if isinstance(obj, array):
+        return obj.tolist()
+    if numpy is not None:
+        if isinstance(obj, numpy.ndarray):
+            if obj.dtype.hasobject:
+                raise TypeError('can not serialize ndarray of dtype object')
+            header = msgpack.packb(
+                [npy_format.dtype_to_descr(obj.dtype), list(obj.shape)])
+            data = numpy.ascontiguousarray(obj).data
+            return msgpack.ExtType(_NDARRAY_EXT, b''.join(
+                [_NDARRAY_HEADER.pack(len(header)), header, data]))
+        if isinstance(obj, numpy.generic):
+            return obj.item()
+    raise TypeError('can not serialize {!r} object'.format(type(obj).__name__))
+
+
+def _ndarray(data):
+    '''Return a read-only array viewing the payload of an ndarray ext type'''
+    size = _NDARRAY_HEADER.unpack_from(data)[0]
+    start = _NDARRAY_HEADER.size
+    dtype, shape = msgpack.unpackb(data[start:start + size], raw=False)
+    return numpy.frombuffer(
+        data, dtype=npy_format.descr_to_dtype(dtype),
+        offset=start + size).reshape(shape)
+
+
+def _ext_hook(code, data):
+    '''Decode the ext types written by _default()'''
+    if code == _NDARRAY_EXT and numpy is not None:
+        return _ndarray(data)
+    return msgpack.ExtType(code, data)
+
+
+def _pack(obj, stream):
+    '''Serialize obj into stream the way dump() writes it'''
+    msgpack.pack(obj, stream, default=_default, use_bin_type=True)
+
+
+def _packb(obj):
+    '''Serialize obj the way dump() writes it'''
+    return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+
+def _unpackb(data):
+    '''Deserialize data written by _packb()'''
+    return msgpack.unpackb(
+        data, raw=False, strict_map_key=False, ext_hook=_ext_hook)
+
+
+def _unpacker(stream=None):
+    '''Return a streaming msgpack.Unpacker matching _unpackb()'''
+    return msgpack.Unpacker(
+        stream, raw=False, strict_map_key=False, ext_hook=_ext_hook)
+
+
+def _view(data):
+    '''Decode an encoded value, returning bytes and ndarray values as
+    zero-copy views of data instead of copies
+    '''
+    first = data[0]
+    if 0xc4 <= first <= 0xc6:  # bin 8/16/32
+        width = 1 << (first - 0xc4)
+        return data[1 + width:]
+    if first in (0xc7, 0xc8, 0xc9):  # ext 8/16/32
+        start = 1 + (1 << (first - 0xc7)) + 1
+    elif 0xd4 <= first <= 0xd8:  # fixext 1/2/4/8/16
+        start = 2
+    else:
+        return _unpackb(data)
+    if data[start - 1] == _NDARRAY_EXT and numpy is not None:
+        return _ndarray(data[start:])
+    return _unpackb(data)
+
+
+def _deepsize(obj):
+    '''Estimate the bytes used by obj and everything it references'''
+    size, seen, stack = 0, set(), [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, memoryview):
+            size += obj.nbytes
+        elif isinstance(obj, (_PackedList, _PackedDict)):
+            size += sys.getsizeof(obj._blob)
+    return size
+
+
+def _typename(value):
+    '''Return the name of the type of value, compact encodings included'''
+    if isinstance(value, _LIST_TYPES):
+        return 'list'
+    if isinstance(value, _DICT_TYPES):
+        return 'dict'
+    return type(value).__name__
+
+
+def _usage(key, value, encoded):
+    '''Return the KeyUsage of a value whose encoding is encoded bytes long'''
+    return KeyUsage(key, _typename(value), _argsize(value),
+                    _deepsize(value), encoded)
+
+
+def _bigkeys(usages, top):
+    '''Return the top largest KeyUsage per type, largest first'''
+    heaps = {}
+    for usage in usages:
+        heap = heaps.setdefault(usage.type, [])
+        item = (usage.size, usage.key, usage)
+        if len(heap) < top:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    return dict((kind, [item[2] for item in sorted(heap, reverse=True)])
+                for kind, heap in heaps.items())
+
+
+_INT64_MIN, _INT64_MAX = -1 << 63, (1 << 63) - 1
+
+
+def _count(blob):
+    '''Return the number of items of an encoded msgpack array or map'''
+    first = blob[0]
+    if 0x80 <= first <= 0x9f:  # fixmap, fixarray
+        return first & 0x0f
+    if first in (0xdc, 0xde):  # array 16, map 16
+        return struct.unpack_from('>H', blob, 1)[0]
+    return struct.unpack_from('>I', blob, 1)[0]  # array 32, map 32
+
+
+def _array_header(count):
+    '''Return the msgpack header of an array of count items'''
+    if count < 16:
+        return bytes([0x90 | count])  # fixarray
+    if count < 0x10000:
+        return b'\xdc' + struct.pack('>H', count)  # array 16
+    return b'\xdd' + struct.pack('>I', count)  # array 32
+
+
+class _PackedList(MutableSequence):
+    '''List stored as a single msgpack blob, for small lists of small scalars'''
+
+    __slots__ = ('_blob',)
+    __hash__ = None
+
+    def __init__(self, items=()):
+        self._blob = _packb(list(items))
+
+    def _plain(self):
+        return _unpackb(self._blob)
+
+    def __reduce__(self):
+        return _PackedList, (self._plain(),)
+
+    def __repr__(self):
+        return '_PackedList({!r})'.format(self._plain())
+
+    def __eq__(self, other):
+        if isinstance(other, (list, _PackedList)):
+            return self._plain() == list(other)
+        return NotImplemented
+
+    def __len__(self):
+        return _count(self._blob)
+
+    def __iter__(self):
+        return iter(self._plain())
+
+    def __reversed__(self):
+        return reversed(self._plain())
+
+    def __contains__(self, value):
+        return value in self._plain()
+
+    def index(self, value, start=0, stop=sys.maxsize):
+        return self._plain().index(value, start, stop)
+
+    def count(self, value):
+        return self._plain().count(value)
+
+    def __getitem__(self, index):
+        return self._plain()[index]
+
+    def __setitem__(self, index, value):
+        items = self._plain()
+        items[index] = value
+        self._blob = _packb(items)
+
+    def __delitem__(self, index):
+        items = self._plain()
+        del items[index]
+        self._blob = _packb(items)
+
+    def insert(self, index, value):
+        items = self._plain()
+        items.insert(index, value)
+        self._blob = _packb(items)
+
+    def append(self, value):
+        items = self._plain()
+        items.append(value)
+        self._blob = _packb(items)
+
+    def extend(self, values):
+        items = self._plain()
+        items.extend(values)
+        self._blob = _packb(items)
+
+
+class _PackedDict(MutableMapping):
+    '''Dict stored as a single msgpack blob, for small dicts of small scalars'''
+
+    __slots__ = ('_blob',)
+
+    def __init__(self, items=()):
+        self._blob = _packb(dict(items))
+
+    def _plain(self):
+        return _unpackb(self._blob)
+
+    def __reduce__(self):
+        return _PackedDict, (self._plain(),)
+
+    def __repr__(self):
+        return '_PackedDict({!r})'.format(self._plain())
+
+    def __len__(self):
+        return _count(self._blob)
+
+    def __iter__(self):
+        return iter(self._plain())
+
+    def __contains__(self, key):
+        return key in self._plain()
+
+    def keys(self):
+        return self._plain().keys()
+
+    def values(self):
+        return self._plain().values()
+
+    def items(self):
+        return self._plain().items()
+
+    def __getitem__(self, key):
+        return self._plain()[key]
+
+    def __setitem__(self, key, value):
+        items = self._plain()
+        items[key] = value
+        self._blob = _packb(items)
+
+    def __delitem__(self, key):
+        items = self._plain()
+        del items[key]
+        self._blob = _packb(items)
+
+    def update(self, *args, **kwargs):
+        items = self._plain()
+        items.update(*[_plain(arg) for arg in args], **kwargs)
+        self._blob = _packb(items)
+
+
+class _SortedKeys(object):
+    '''Sorted index of the keys of db, kept in blocks of a bounded size
+
+    Inserting or removing a key only shifts the keys of one block, so
+    loading keys in random order stays O(n log n) instead of O(n^2).
+    '''
+
+    _load = 1000
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._blocks = [keys[pos:pos + self._load]
+                        for pos in range(0, len(keys), self._load)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = len(keys)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for block in self._blocks:
+            for key in block:
+                yield key
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._len
+        if 0 <= index < self._len:
+            for block in self._blocks:
+                if index < len(block):
+                    return block[index]
+                index -= len(block)
+        raise IndexError('key index out of range')
+
+    def add(self, key):
+        '''Insert a key, doing nothing if it is already in the index'''
+        maxes = self._maxes
+        if not maxes:
+            self._blocks.append([key])
+            maxes.append(key)
+            self._len = 1
+            return
+        i = bisect_left(maxes, key)
+        if i == len(maxes):
+            i -= 1
+            block = self._blocks[i]
+            block.append(key)
+            maxes[i] = key
+        else:
+            block = self._blocks[i]
+            pos = bisect_left(block, key)
+            if block[pos] == key:
+                return
+            block.insert(pos, key)
+        self._len += 1
+        if len(block) > 2 * self._load:
+            self._blocks[i:i + 1] = [block[:self._load], block[self._load:]]
+            maxes[i:i + 1] = [block[self._load - 1], block[-1]]
+
+    def discard(self, key):
+        '''Remove a key, doing nothing if it is not in the index'''
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return
+        block = self._blocks[i]
+        pos = bisect_left(block, key)
+        if block[pos] != key:
+            return
+        del block[pos]
+        self._len -= 1
+        if block:
+            self._maxes[i] = block[-1]
+        else:
+            del self._blocks[i]
+            del self._maxes[i]
+
+    def after(self, key, count, inclusive=False):
+        '''Return up to count keys following key in order, all if key is None'''
+        if key is None:
+            i = pos = 0
+        else:
+            find = bisect_left if inclusive else bisect_right
+            i = find(self._maxes, key)
+            pos = find(self._blocks[i], key) if i < len(self._blocks) else 0
+        found = []
+        while i < len(self._blocks) and len(found) < count:
+            found.extend(self._blocks[i][pos:pos + count - len(found)])
+            i += 1
+            pos = 0
+        return found
+
+
+_LIST_TYPES = (list, _PackedList, array)
+_DICT_TYPES = (dict, _PackedDict)
+_COMPACT_TYPES = frozenset([_PackedList, _PackedDict, array])
+
+
+def _small(value, size):
+    '''Return True if value is a scalar that fits into a packed encoding'''
+    if value is None or isinstance(value, (bool, float)):
+        return True
+    if isinstance(value, int):
+        return _INT64_MIN <= value <= _INT64_MAX
+    if isinstance(value, (str, bytes)):
+        return len(value) <= size
+    return False
+
+
+def _fits(typecode, values):
+    '''Return True if all values can be stored in an array of typecode
+    without changing their type
+    '''
+    if typecode == 'q':
+        return all(type(v) is int and _INT64_MIN <= v <= _INT64_MAX for v in values)
+    return all(type(v) is float for v in values)
+
+
+def _plain(value):
+    '''Return a compact value as a plain list or dict, which is what
+    reads hand out so compact mode stays invisible to callers
+    '''
+    kind = type(value)
+    if kind not in _COMPACT_TYPES:  # cheaper than isinstance() on the ABCs
+        return value
+    if kind is array:
+        return value.tolist()
+    return value._plain()
+
+
+def _argsize(arg):
+    '''Return len() of an argument if it has one, else None'''
+    try:
+        return len(arg)
+    except TypeError:
+        return None
+
+
+def _literal_prefix(pattern):
+    '''Return the part of a glob pattern before its first wildcard'''
+    for pos, char in enumerate(pattern):
+        if char in '*?[':
+            return pattern[:pos]
+    return pattern
+
+
+def _path_parts(path):
+    '''Split a dotted path into segments, the first one being a key of db'''
+    parts = path.split('.') if isinstance(path, str) else list(path)
+    if not parts or not isinstance(parts[0], str):
+        raise ThanosDB.key_string_error
+    return parts
+
+
+def _materialized(arg):
+    '''Return an iterator argument as a list, so it can be applied and sent'''
+    return list(arg) if isinstance(arg, Iterator) else arg
+
+
+def _written_key(argname, args, kwargs):
+    '''Return the key of db written by a call, from its first argument'''
+    key = args[0] if args else kwargs.get(argname)
+    if argname == 'path':
+        return _path_parts(key)[0]
+    return key
+
+
+def _command(func):
+    '''Wrap a ThanosDB operation so it goes through the dispatch path.
+
+    Runs the registered before/after hooks and records the call in the
+    slowlog when it takes longer than *slowlog_threshold* seconds. Only
+    the outermost call of a thread does so, not the operations it runs
+    internally.
+    '''
+    name = func.__name__
+
+    @functools.wraps(func)
+    def dispatch(self, *args, **kwargs):
+        threshold = self.slowlog_threshold
+        calls = self._calls
+        if threshold is None and not self._hooks or getattr(calls, 'active', False):
+            return func(self, *args, **kwargs)
+        calls.active = True
+        try:
+            for before, _ in self._hooks:
+                if before is not None:
+                    before(name, args, kwargs)
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                if threshold is not None and duration >= threshold:
+                    self._slowlog_add(name, args, kwargs, duration)
+                for _, after in self._hooks:
+                    if after is not None:
+                        after(name, args, kwargs, duration)
+        finally:
+            calls.active = False
+    return dispatch
+
+
+def _write_command(func, conditional=False):
+    '''Wrap a ThanosDB operation that modifies db.
+
+    Besides the dispatch path of _command, the operation runs under the
+    db lock and bumps the version of the key named by its first argument,
+    which is what WATCH compares against. Operations not called from
+    another write are then published to subscribers and followers; with
+    followers connected the call is encoded for them before db is touched,
+    so arguments that can not be serialized, or that a later write changes
+    in place, never make followers diverge. A *conditional* operation returns False when it
+    found nothing to change, and is then neither versioned nor published.
+    '''
+    dispatch = _command(func)
+    name = func.__name__
+    argname = func.__code__.co_varnames[1] if func.__code__.co_argcount > 1 else None
+
+    @functools.wraps(func)
+    def write(self, *args, **kwargs):
+        with self._lock:
+            if self.read_only:
+                raise self.read_only_error
+            encoded = None
+            if self._replicas and not self._depth:
+                args = tuple(_materialized(arg) for arg in args)
+                kwargs = {k: _materialized(v) for k, v in kwargs.items()}
+                encoded = _packb([name, args, kwargs])
+            self._depth += 1
+            try:
+                result = dispatch(self, *args, **kwargs)
+            finally:
+                self._depth -= 1
+            if conditional and result is False:
+                return result
+            key = _written_key(argname, args, kwargs)
+            self._touch(key)
+            if not self._depth:
+                self._propagate(name, key, encoded)
+        return result
+    write.argname = argname
+    return write
+
+
+def _conditional_write_command(func):
+    '''Wrap a ThanosDB operation that returns False when it modified nothing'''
+    return _write_command(func, conditional=True)
+
+
+class WatchError(Exception):
+    '''Raised by Transaction.execute() when a watched key was modified'''
+
+
+_MISSING = object()
+
+# Writes that store a new value under their key instead of changing the
+# old one, which is therefore enough to undo them.
+_REPLACING_WRITES = frozenset([
+    'set', 'rem', 'append', 'incrby', 'incr', 'decr', 'incrbyfloat',
+    'lcreate', 'lremlist', 'dcreate', 'drem'])
+
+
+def _call_args(func, args, kwargs):
+    '''Return the arguments of a call to a ThanosDB method by name'''
+    code = func.__code__
+    call = dict(zip(code.co_varnames[1:code.co_argcount], args))
+    call.update(kwargs)
+    return call
+
+
+def _undo_db(db, everything):
+    '''Return an undo putting back all keys of db'''
+    def undo():
+        db.db = everything
+    return undo
+
+
+def _undo_key(db, key, value):
+    '''Return an undo putting value back under key, removing key if _MISSING'''
+    def undo():
+        if value is _MISSING:
+            db.db.pop(key, None)
+        else:
+            db.db[key] = value
+    return undo
+
+
+def _undo_list_length(db, key, length):
+    '''Return an undo dropping what was appended to the list under key'''
+    def undo():
+        del db.db[key][length:]
+    return undo
+
+
+def _undo_list_item(db, key, removed, length, pos, item):
+    '''Return an undo putting item back at pos of the list under key,
+    reinserting it if it was removed
+    '''
+    pos %= length
+    def undo():
+        items = db.db[key]
+        if not removed:
+            items[pos] = item
+        elif len(items) < length:
+            items.insert(pos, item)
+    return undo
+
+
+def _undo_fields(db, key, fields):
+    '''Return an undo putting back the (field, value) pairs of the dict
+    under key, removing the fields whose value is _MISSING
+    '''
+    def undo():
+        items = db.db[key]
+        for field, value in fields:
+            if value is _MISSING:
+                items.pop(field, None)
+            else:
+                items[field] = value
+    return undo
+
+
+class Transaction(object):
+    '''
+    Queue of ThanosDB operations applied all-or-nothing with a single dump.
+
+    Any operation of the database can be called on the transaction, it is
+    queued instead of being run. Keys passed to watch() make execute()
+    fail with WatchError if another writer modified them in the meantime.
+
+    :Example:
+
+    >>> tx = db.multi('avengers')
+    >>> hero = db.lget('avengers', 0)
+    >>> tx.lpop('avengers', 0).ladd('retired', hero)
+    <thanosdb.thanosdb.Transaction object at 0x7f0c2a3b>
+    >>> tx.execute()
+    ['Iron Man', True]
+
+    :param db: database the operations are applied to
+    :type db: ThanosDB
+    '''
+
+    def __init__(self, db):
+        self.db = db
+        self.queue = []
+        self.watched = {}
+
+    def __getattr__(self, name):
+        method = getattr(type(self.db), name, None)
+        if name.startswith('_') or not hasattr(method, '__wrapped__'):
+            raise AttributeError(name)
+
+        def queue(*args, **kwargs):
+            self.queue.append((name, args, kwargs))
+            return self
+        return queue
+
+    def watch(self, *keys):
+        '''Mark keys to be checked for modification by execute()
+
+        :param keys: Names of keys in db
+        :type keys: string
+        :return: True
+        :rtype: Boolean
+        '''
+        for key in keys:
+            if key in self.watched:
+                self.watched[key] = self.db._version(key)
+            else:
+                self.watched[key] = self.db._watch(key)
+        return True
+
+    def unwatch(self):
+        '''Forget all watched keys
+
+        :return: True
+        :rtype: Boolean
+        '''
+        self.db._unwatch(self.watched)
+        self.watched = {}
+        return True
+
+    def discard(self):
+        '''Drop all queued operations and watched keys
+
+        :return: True
+        :rtype: Boolean
+        '''
+        self.queue = []
+        return self.unwatch()
+
+    def _undo(self, name, args, kwargs):
+        '''Return a callable that restores what a queued operation is
+        about to change, or None for reads. Called before the operation
+        runs; only what it touches is saved, whole values are deep-copied
+        only for operations without a cheap undo.
+        '''
+        db = self.db
+        method = getattr(type(db), name)
+        argname = getattr(method, 'argname', _MISSING)
+        if argname is _MISSING:
+            return None
+        if argname is None:
+            return _undo_db(db, dict(db.db))
+        key = _written_key(argname, args, kwargs)
+        if key not in db.db:
+            return _undo_key(db, key, _MISSING)
+        value = db.db[key]
+        if name in _REPLACING_WRITES:
+            return _undo_key(db, key, value)
+        call = _call_args(method.__wrapped__, args, kwargs)
+        if isinstance(value, _LIST_TYPES):
+            if name in ('ladd', 'lextend'):
+                return _undo_list_length(db, key, len(value))
+            if name in ('lpop', 'lremvalue', 'lappend'):
+                pos = call.get('pos')
+                if name == 'lremvalue':
+                    pos = value.index(call.get('value'))
+                if type(pos) is int:
+                    return _undo_list_item(
+                        db, key, name != 'lappend', len(value), pos, value[pos])
+        elif isinstance(value, _DICT_TYPES):
+            if name == 'dadd':
+                fields = [call['pair'][0]]
+            elif name in ('dincrby', 'dpop'):
+                fields = [call['key']]
+            elif name == 'dmerge':
+                fields = list(_plain(db.db.get(call['name2'], {})))
+            else:
+                fields = None
+            if fields is not None:
+                plain = _plain(value)
+                return _undo_fields(
+                    db, key, [(field, plain.get(field, _MISSING)) for field in fields])
+        return _undo_key(db, key, copy.deepcopy(value))
+
+    def execute(self):
+        '''Apply all queued operations, or none of them if one fails
+
+        :return: List with the result of every queued operation.
+        :rtype: list
+        :raises WatchError: if a watched key was modified since watch()
+        '''
+        db = self.db
+        with db._lock:
+            try:
+                for key, version in self.watched.items():
+                    if db._version(key) != version:
+                        raise WatchError('Watched key {!r} was modified.'.format(key))
+                undo, results = [], []
+                db._batched = True
+                try:
+                    for name, args, kwargs in self.queue:
+                        undo.append(self._undo(name, args, kwargs))
+                        results.append(getattr(db, name)(*args, **kwargs))
+                except Exception:
+                    db._pending = []
+                    db._rollback(undo)
+                    raise
+                finally:
+                    db._batched = False
+            finally:
+                self.discard()
+            db._flush()
+            db._autodumpdb()
+        return results
+
+
+def _wake(future):
+    '''Resolve an asyncio future waiting for an event'''
+    if not future.done():
+        future.set_result(None)
+
+
+class Subscription(object):
+    '''
+    Stream of change events for the keys of a ThanosDB matching a pattern.
+
+    Events are Event(command, key) tuples, key is None for deldb. Without a
+    callback they are buffered in a bounded queue read with get(), plain
+    iteration or ``async for``; when the queue is full the oldest event is
+    dropped and counted in *dropped*, so a slow reader never blocks writers.
+    A callback is instead called synchronously by the writer.
+
+    :Example:
+
+    >>> sub = db.subscribe('session:*')
+    >>> db.set('session:1', 'data')
+    True
+    >>> sub.get()
+    Event(command='set', key='session:1')
+
+    :param db: database to subscribe to
+    :type db: ThanosDB
+    :param pattern: glob-style pattern of keys
+    :type pattern: string
+    :param callback: called with every event instead of queueing it
+    :type callback: callable
+    :param maxlen: maximum number of queued events
+    :type maxlen: int
+    '''
+
+    def __init__(self, db, pattern='*', callback=None, maxlen=1024):
+        self.db = db
+        self.pattern = pattern
+        self.callback = callback
+        self.events = deque(maxlen=maxlen)
+        self.dropped = 0
+        self.closed = False
+        self._cond = Condition()
+        self._waiters = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        event = self.get()
+        if event is None:
+            raise StopIteration
+        return event
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            with self._cond:
+                if self.events:
+                    return self.events.popleft()
+                if self.closed:
+                    raise StopAsyncIteration
+                loop = asyncio.get_event_loop()
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            await future
+
+    def _matches(self, key):
+        '''Return True if events for key are delivered to this subscription'''
+        return key is None or self.pattern == '*' or fnmatchcase(key, self.pattern)
+
+    def _deliver(self, event):
+        '''Queue an event or pass it to the callback'''
+        if self.callback is not None:
+            try:
+                self.callback(event)
+            except Exception:
+                _log.exception('Subscription callback failed on %r', event)
+            return
+        with self._cond:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append(event)
+            self._cond.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass  # the event loop was closed
+
+    def get(self, timeout=None):
+        '''Return the next event, waiting up to timeout seconds
+
+        :param timeout: seconds to wait, forever if None
+        :type timeout: float
+        :return: Next event, or None on timeout or once closed and drained.
+        :rtype: Event
+        '''
+        with self._cond:
+            if not self.events and not self.closed:
+                self._cond.wait(timeout)
+            if self.events:
+                return self.events.popleft()
+            return None
+
+    def close(self):
+        '''Stop receiving events and wake up all waiting readers
+
+        :return: True
+        :rtype: Boolean
+        '''
+        self.db.unsubscribe(self)
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass
+        return True
+
+
+class _ReplicaLink(object):
+    '''Connection from a primary to one follower with its send queue'''
+
+    def __init__(self, db, sock, maxlen, interval):
+        self.db = db
+        self.sock = sock
+        self.maxlen = maxlen
+        self.interval = interval
+        self.queue = deque()
+        self.closed = False
+        self._cond = Condition()
+
+    def push(self, data):
+        '''Queue an encoded record, dropping the follower if it fell too far behind'''
+        with self._cond:
+            if len(self.queue) >= self.maxlen:
+                self.closed = True
+            else:
+                self.queue.append(data)
+            self._cond.notify()
+
+    def close(self):
+        '''Disconnect the follower'''
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def run(self, snapshot):
+        '''Send the snapshot, then queued records and heartbeats until closed'''
+        try:
+            self.sock.sendall(snapshot)
+            while True:
+                with self._cond:
+                    if not self.queue and not self.closed:
+                        self._cond.wait(self.interval)
+                    if self.closed:
+                        return
+                    records = list(self.queue)
+                    self.queue.clear()
+                if not records:
+                    records = [_packb(['ping', self.db._repl_offset, time.time()])]
+                self.sock.sendall(b''.join(records))
+        except OSError:
+            pass
+        finally:
+            self.db._replica_remove(self)
+            self.sock.close()
+
+
+def _connect(address):
+    '''Open a stream socket to a path (unix socket) or a (host, port) tuple'''
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+        return sock
+    return socket.create_connection(address)
+
+
+_SNAPSHOT_MAGIC = b'THSN'
+_SNAPSHOT_HEADER = struct.Struct('<4sIQQ')  # magic, format, generation, index size
+
+
+class Snapshot(object):
+    '''
+    Read-only view of a snapshot file written by ThanosDB.publish_snapshot().
+
+    The file is memory-mapped, so every process opening it shares one copy
+    of the encoded values in the page cache. Only the key to offset index is
+    decoded per process; values are decoded on access, and raw() hands out
+    zero-copy views of their encoded bytes. The writer replaces the file
+    atomically, refresh() switches to the newest generation.
+
+    :Example:
+
+    >>> snap = thanosdb.open_snapshot('avengers.db.snap')
+    >>> snap.get('ironman')
+    'Tony Stark'
+    >>> snap.generation
+    3
+
+    :param path: location of the snapshot file
+    :type path: string
+    :param check_interval: seconds between automatic checks for a new generation, None to only refresh() manually
+    :type check_interval: float
+    '''
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = os.path.expanduser(path)
+        self.check_interval = check_interval
+        self._stat = None
+        self._checked = 0.0
+        self.refresh()
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def refresh(self):
+        '''Map the newest generation of the snapshot if the file was replaced
+
+        Views returned by raw() stay valid, they keep the old mapping alive.
+
+        :return: True if a new generation was mapped, else False.
+        :rtype: Boolean
+        '''
+        self._checked = time.time()
+        stat = os.stat(self.path)
+        if self._stat is not None and (stat.st_ino, stat.st_mtime_ns) == self._stat:
+            return False
+        with open(self.path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+        magic, _, generation, size = _SNAPSHOT_HEADER.unpack_from(buf)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError('{} is not a ThanosDB snapshot.'.format(self.path))
+        start = _SNAPSHOT_HEADER.size
+        self.index = _unpackb(buf[start:start + size])
+        self.generation = generation
+        self._data = memoryview(buf)[start + size:]
+        self._stat = (stat.st_ino, stat.st_mtime_ns)
+        return True
+
+    def _maybe_refresh(self):
+        '''Refresh if check_interval seconds passed since the last check'''
+        if (self.check_interval is not None
+                and time.time() - self._checked >= self.check_interval):
+            self.refresh()
+
+    def raw(self, key):
+        '''Return the msgpack encoded value of a key without copying it
+
+        :param key: Name of key in the snapshot
+        :type key: string
+        :return: memoryview of the encoded value, None if key is not present.
+        :rtype: memoryview
+        '''
+        self._maybe_refresh()
+        try:
+            offset, length = self.index[key]
+        except KeyError:
+            return None
+        return self._data[offset:offset + length]
+
+    def get(self, key):
+        '''Get the value of a key
+
+        :param key: Name of key in the snapshot
+        :type key: string
+        :return: Value if key present else returns false.
+        '''
+        data = self.raw(key)
+        if data is None:
+            return False
+        return _unpackb(data)
+
+    def view(self, key):
+        '''Get the value of a key, without copying bytes and NumPy arrays
+
+        Bytes values are returned as memoryview and arrays as read-only
+        ndarray, both pointing straight into the mapped file. Other values
+        are decoded like get().
+
+        :param key: Name of key in the snapshot
+        :type key: string
+        :return: Value if key present else returns false.
+        '''
+        data = self.raw(key)
+        if data is None:
+            return False
+        return _view(data)
+
+    def exists(self, key):
+        '''Return True if key exists in the snapshot, return False if not'''
+        self._maybe_refresh()
+        return key in self.index
+
+    def getall(self):
+        '''Return all keys in the snapshot'''
+        self._maybe_refresh()
+        return self.index.keys()
+
+
+def open_snapshot(path, check_interval=1.0):
+    '''Return a Snapshot reading the snapshot file at path.'''
+    return Snapshot(path, check_interval)
+
+
+def analyze(location, top=10):
+    '''Return the bigkeys() report of a db file without loading it whole.
+
+    The file is read as a stream and only one value is decoded at a time.
+    '''
+    with open(os.path.expanduser(location), 'rb') as f:
+        unpacker = _unpacker(f)
+        count = unpacker.read_map_header()
+
+        def usages():
+            for _ in range(count):
+                key = unpacker.unpack()
+                start = unpacker.tell()
+                value = unpacker.unpack()
+                yield _usage(key, value, unpacker.tell() - start)
+        return _bigkeys(usages(), top)
+
+
+_FORMATS = {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv',
+            '.msgpack': 'msgpack', '.mp': 'msgpack'}
+
+
+def _format_of(path, format):
+    '''Return the record format given explicitly or by the file extension'''
+    if format is None:
+        format = _FORMATS.get(os.path.splitext(path)[1].lower())
+    if format not in ('jsonl', 'csv', 'msgpack'):
+        raise ValueError('Unknown format for {}, use jsonl, csv or msgpack.'.format(path))
+    return format
+
+
+def _open_records(path, format, mode):
+    '''Open a file of records in text or binary mode depending on format'''
+    if format == 'msgpack':
+        return open(path, mode + 'b')
+    return open(path, mode, encoding='utf-8', newline='' if format == 'csv' else None)
+
+
+def _read_records(stream, format):
+    '''Yield raw records of a source: JSON lines or [key, value] pairs'''
+    if format == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield line
+    elif format == 'csv':
+        rows = csv.reader(stream)
+        next(rows, None)  # key,value header
+        for row in rows:
+            yield row
+    else:
+        for record in _unpacker(stream):
+            yield record
+
+
+def _csv_value(text):
+    '''Return the JSON value in a CSV cell, or the text itself if it is
+    not JSON, so plain CSV files import as strings
+    '''
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _encode_records(job):
+    '''Encode a chunk of records into consecutive msgpack keys and values,
+    returned with the keys and the encoded size of each pair
+    '''
+    format, records = job
+    keys, sizes, out = [], [], []
+    for record in records:
+        if format == 'jsonl':
+            record = json.loads(record)
+            key, value = record['key'], record['value']
+        elif format == 'csv':
+            key, value = record[0], _csv_value(record[1])
+        else:
+            key, value = record
+        if not isinstance(key, str):
+            raise ThanosDB.key_string_error
+        pair = _packb(key) + _packb(value)
+        keys.append(key)
+        sizes.append(len(pair))
+        out.append(pair)
+    return keys, sizes, b''.join(out)
+
+
+def _chunks(iterable, size):
+    '''Yield lists of up to size items of iterable'''
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _encode_source(source, format, workers, chunksize):
+    '''Yield (keys, sizes, data) for chunks of records of source, encoded in parallel'''
+    with _open_records(source, format, 'r') as stream:
+        jobs = ((format, chunk) for chunk in
+                _chunks(_read_records(stream, format), chunksize))
+        if format == 'msgpack' or workers in (0, 1):
+            for result in map(_encode_records, jobs):
+                yield result
+            return
+        pool = multiprocessing.Pool(workers)
+        try:
+            for result in pool.imap(_encode_records, jobs):
+                yield result
+        except BaseException:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+
+
+def _copy_entries(location, out, skip):
+    '''Copy the entries of a db file into out without decoding their
+    values, leaving out the keys in skip. Returns the number copied.
+    '''
+    with open(location, 'rb') as f, open(location, 'rb') as raw:
+        unpacker = _unpacker(f)
+        total = unpacker.read_map_header()
+        raw.seek(unpacker.tell())
+        if not skip:
+            shutil.copyfileobj(raw, out)
+            return total
+        count = 0
+        for _ in range(total):
+            key = unpacker.unpack()
+            unpacker.skip()
+            if key in skip:
+                raw.seek(unpacker.tell())
+            else:
+                out.write(raw.read(unpacker.tell() - raw.tell()))
+                count += 1
+    return count
+
+
+def import_file(location, source, format=None, workers=None, chunksize=1000):
+    '''Stream records from source into the db file at location.
+
+    source holds JSON lines of {"key": ..., "value": ...} objects, CSV rows
+    of a key and a JSON encoded value (plain text is read as a string)
+    under a key,value header or a msgpack
+    stream of [key, value] arrays; the format is taken from the extension
+    unless given. Text records are parsed and encoded by a pool of
+    *workers* processes (one per CPU if None, in process if 0 or 1) and
+    staged in a side file, then written into a new db file behind the
+    existing entries, which are copied without decoding their values.
+    Imported keys replace existing ones, and a key repeated in source keeps
+    its last value. Loaded ThanosDB objects see the result after load().
+
+    :return: Number of imported records.
+    '''
+    location = os.path.expanduser(location)
+    format = _format_of(source, format)
+    tmp = '{}.{}.tmp'.format(location, os.getpid())
+    staging = tmp + '.records'
+    spans = {}
+    count = imported = 0
+    try:
+        with open(staging, 'w+b') as staged:
+            for keys, sizes, data in _encode_source(source, format, workers, chunksize):
+                offset = staged.tell()
+                staged.write(data)
+                for key, size in zip(keys, sizes):
+                    spans[key] = (offset, size)
+                    offset += size
+                imported += len(keys)
+            with open(tmp, 'wb') as out:
+                out.write(b'\xdf\x00\x00\x00\x00')  # map 32, count patched below
+                if os.path.exists(location):
+                    count = _copy_entries(location, out, spans)
+                staged.seek(0)
+                if len(spans) == imported:
+                    shutil.copyfileobj(staged, out)
+                else:
+                    for offset, size in sorted(spans.values()):
+                        staged.seek(offset)
+                        out.write(staged.read(size))
+                out.seek(1)
+                out.write(struct.pack('>I', count + len(spans)))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        if os.path.exists(staging):
+            os.remove(staging)
+    os.replace(tmp, location)
+    return imported
+
+
+def _json_record(key, value, format):
+    '''Return value as JSON, raising a TypeError naming key if it holds
+    binary data no JSON based format can hold
+    '''
+    try:
+        return json.dumps(value)
+    except TypeError:
+        raise TypeError('Value of key {!r} holds binary data, which {} can not '
+                        'hold; export to msgpack instead.'.format(key, format))
+
+
+def export_file(location, target, format=None):
+    '''Stream all key-value pairs of the db file at location into target.
+
+    Uses the formats of import_file(), so CSV values are written as JSON.
+    Only one value is decoded at a time. The records are written to a
+    temporary file that replaces target once complete; bytes and ndarray
+    values can only be exported to msgpack.
+
+    :return: Number of exported records.
+    '''
+    format = _format_of(target, format)
+    tmp = '{}.{}.tmp'.format(target, os.getpid())
+    try:
+        with open(os.path.expanduser(location), 'rb') as f:
+            unpacker = _unpacker(f)
+            count = unpacker.read_map_header()
+            with _open_records(tmp, format, 'w') as out:
+                if format == 'csv':
+                    writer = csv.writer(out)
+                    writer.writerow(['key', 'value'])
+                for _ in range(count):
+                    key, value = unpacker.unpack(), unpacker.unpack()
+                    if format == 'jsonl':
+                        out.write('{{"key": {}, "value": {}}}\n'.format(
+                            json.dumps(key), _json_record(key, value, format)))
+                    elif format == 'csv':
+                        writer.writerow([key, _json_record(key, value, format)])
+                    else:
+                        out.write(_packb([key, value]))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, target)
+    return count
+
+
+def load(location, auto_dump, sig=True, compact=False):
     '''Return a thanosdb object. location is the path to the msgpack file.'''
-    return ThanosDB(location, auto_dump, sig)
+    return ThanosDB(location, auto_dump, sig, compact)
+
+
+def follow(address, reconnect=1.0):
+    '''Return a read-only Follower replicating the primary serving on address.'''
+    return Follower(address, reconnect)
 
 class ThanosDB(object):
     '''
@@ -31,19 +1389,64 @@ class ThanosDB(object):
     :type auto_dump: boolean
     :param sig: used for graceful shutdown during dump if True
     :type sig: boolean
+    :param compact: store lists and dicts in compact encodings if True
+    :type compact: boolean
     '''
 
     key_string_error = TypeError('Only string type is supported as key.')
-
-    def __init__(self, location, auto_dump, sig):
+    read_only_error = RuntimeError('Follower instances are read-only.')
+    value_int_error = TypeError('Value is not an integer.')
+    value_float_error = TypeError('Value is not a number.')
+    value_dict_error = TypeError('Value is not a dict.')
+
+    #: Operations taking at least this many seconds are recorded in the
+    #: slowlog. None disables the slowlog.
+    slowlog_threshold = 0.01
+    #: Maximum number of entries kept in the slowlog ring buffer.
+    slowlog_max_len = 128
+    #: Write operations raise read_only_error if True.
+    read_only = False
+    #: Store lists and dicts in compact encodings, like Redis ziplists:
+    #: lists and dicts of at most compact_max_entries scalars no longer than
+    #: compact_max_value are packed into one msgpack blob, lists of at least
+    #: compact_array_min ints or floats are kept in an array.array. Values
+    #: move between encodings automatically as they change, and reads
+    #: return them as plain lists and dicts.
+    compact = False
+    compact_max_entries = 64
+    compact_max_value = 64
+    compact_array_min = 128
+
+    def __init__(self, location, auto_dump, sig, compact=False):
         '''Creates a database object and loads the data from the location path.
         If the file does not exist it will be created on the first update.
         '''
+        self._init_state()
+        self.compact = compact
         self.load(location, auto_dump)
         self.dthread = None
         if sig:
             self._set_sigterm_handler()
 
+    def _init_state(self):
+        '''Set up the in-memory state that is kept across load() calls'''
+        self._hooks = []
+        self._calls = local()
+        self.slowlog = deque(maxlen=self.slowlog_max_len)
+        self._slowlog_id = 0
+        self._indexes = {}
+        self._lock = RLock()
+        self._batched = False
+        self._depth = 0
+        self._pending = []
+        self._subscribers = []
+        self._versions = {}
+        self._watchers = {}
+        self._epoch = 0
+        self._replicas = []
+        self._repl_server = None
+        self._repl_offset = 0
+
     def __getitem__(self, item):
         '''Syntax sugar for get()'''
         return self.get(item)
@@ -62,65 +1465,539 @@ class ThanosDB(object):
         *Ensures that the key-value operations get written to disk in case of db failure\
             to maintain consistency.*
         '''
-        def sigterm_handler():
+        def sigterm_handler(signum, frame):
             if self.dthread is not None:
                 self.dthread.join()
             sys.exit(0)
         signal.signal(signal.SIGTERM, sigterm_handler)
 
-    def load(self, location, auto_dump):
-        '''Loads, reloads or changes the path to the db file
+    def _slowlog_add(self, name, args, kwargs, duration):
+        '''Append an entry for a slow operation to the slowlog'''
+        if self.slowlog.maxlen != self.slowlog_max_len:
+            self.slowlog = deque(self.slowlog, maxlen=self.slowlog_max_len)
+        key = args[0] if args and isinstance(args[0], str) else None
+        sizes = [_argsize(arg) for arg in args[1:]]
+        sizes.extend(_argsize(arg) for arg in kwargs.values())
+        self.slowlog.append(SlowlogEntry(
+            self._slowlog_id, time.time(), duration, name, key, sizes))
+        self._slowlog_id += 1
+
+    def slowlog_get(self, count=None):
+        '''Return the most recent slowlog entries, newest first
+
+        :Example:
+
+        >>> db.slowlog_threshold = 0
+        >>> db.set('ironman', 'Tony Stark')
+        True
+        >>> db.slowlog_get(1)
+        [SlowlogEntry(id=0, timestamp=1571234567.0, duration=1.2e-05, command='set', key='ironman', arg_sizes=[10])]
+
+        :param count: Number of entries to return, all entries if None
+        :type count: int
+        :return: Slowlog entries with id, timestamp, duration, command, key and arg_sizes.
+        :rtype: list
+        '''
+        entries = list(reversed(self.slowlog))
+        if count is not None:
+            entries = entries[:count]
+        return entries
+
+    def slowlog_len(self):
+        '''Return the number of entries in the slowlog
+
+        :return: Length of the slowlog.
+        :rtype: int
+        '''
+        return len(self.slowlog)
+
+    def slowlog_reset(self):
+        '''Remove all entries from the slowlog
+
+        :return: True
+        :rtype: Boolean
+        '''
+        self.slowlog.clear()
+        return True
+
+    def add_hook(self, before=None, after=None):
+        '''Register callables run around every operation
+
+        *before* is called as before(command, args, kwargs) and *after* as
+        after(command, args, kwargs, duration), so profilers or tracers can
+        be attached without patching the class. Operations run internally
+        by another one, or by a hook, are not reported.
+
+        :Example:
+
+        >>> import cProfile
+        >>> prof = cProfile.Profile()
+        >>> hook = db.add_hook(lambda *a: prof.enable(), lambda *a: prof.disable())
+        >>> db.remove_hook(hook)
+        True
+
+        :param before: called before the operation runs
+        :type before: callable
+        :param after: called after the operation returns or raises
+        :type after: callable
+        :return: Handle to pass to remove_hook().
+        :rtype: tuple
+        '''
+        hook = (before, after)
+        self._hooks = self._hooks + [hook]
+        return hook
+
+    def remove_hook(self, hook):
+        '''Unregister a hook returned by add_hook()
+
+        :param hook: Handle returned by add_hook()
+        :type hook: tuple
+        :return: True if the hook was registered, else False.
+        :rtype: Boolean
+        '''
+        if not any(h is hook for h in self._hooks):
+            return False
+        self._hooks = [h for h in self._hooks if h is not hook]
+        return True
+
+    def load(self, location, auto_dump):
+        '''Loads, reloads or changes the path to the db file
+
+        :Example:
+
+        >>> from thanosdb import thanosdb
+        >>> db = thanosdb.load('avengers.db', True, False)
+
+        :param location: location of msgpack database file
+        :type location: string
+        :param auto_dump: writes to disk after every operation
+        :type auto_dump: boolean
+        :param sig: used for graceful shutdown during dump
+        :type sig: boolean
+        '''
+        location = os.path.expanduser(location)
+        self.loco = location
+        self.auto_dump = auto_dump
+        if os.path.exists(location):
+            self._loaddb()
+        else:
+            self.db = {}
+        if self.compact:
+            for key in self.db:
+                self.db[key] = self._compacted(self.db[key])
+        self._keys = _SortedKeys(self.db)
+        self._index_rebuild()
+        return True
+
+    @_command
+    def dump(self):
+        '''
+        Force dump memory db to file.
+
+        :Example:
+
+        >>> db.dump()
+        True
+
+        :return: True
+        :rtype: Boolean
+        '''
+        _pack(self.db, open(self.loco, 'wb'))
+        self.dthread = Thread(
+            target=_pack,
+            args=(self.db, open(self.loco, 'wb')))
+        self.dthread.start()
+        self.dthread.join()
+        return True
+
+    def _loaddb(self):
+        '''Load or reload the msgpack info from the file'''
+        with open(self.loco, 'rb') as f:
+            self.db = _unpackb(f.read())
+
+    def _keyindex_add(self, key):
+        '''Insert a new key into the sorted key index'''
+        self._keys.add(key)
+
+    def _keyindex_rem(self, key):
+        '''Remove a key from the sorted key index'''
+        self._keys.discard(key)
+
+    def _compacted(self, value):
+        '''Return a list or dict in the most compact encoding its contents allow'''
+        if isinstance(value, _LIST_TYPES):
+            if (len(value) <= self.compact_max_entries and
+                    all(_small(v, self.compact_max_value) for v in value)):
+                return value if isinstance(value, _PackedList) else _PackedList(value)
+            if len(value) >= self.compact_array_min:
+                if isinstance(value, array):
+                    return value
+                for typecode in ('q', 'd'):
+                    if _fits(typecode, value):
+                        return array(typecode, value)
+            return value if type(value) is list else list(value)
+        if isinstance(value, _DICT_TYPES):
+            size = self.compact_max_value
+            if (len(value) <= self.compact_max_entries and
+                    all(_small(k, size) and _small(v, size) for k, v in value.items())):
+                return value if isinstance(value, _PackedDict) else _PackedDict(value)
+            return value if type(value) is dict else dict(_plain(value))
+        return value
+
+    def _recompact(self, name, added):
+        '''Move the value of name to another encoding if the items just
+        added to it no longer fit its current one or make it qualify for an
+        array. Only the added items are looked at, except on a switch.
+        '''
+        if not self.compact:
+            return
+        value = self.db[name]
+        if isinstance(value, (_PackedList, _PackedDict)):
+            if (len(value) > self.compact_max_entries or
+                    not all(_small(v, self.compact_max_value) for v in added)):
+                self.db[name] = self._compacted(value._plain())
+        elif type(value) is list and len(value) - len(added) < self.compact_array_min <= len(value):
+            self.db[name] = self._compacted(value)
+
+    def _writable(self, name, values):
+        '''Turn the array stored under name back into a list if values
+        can not be stored in it without changing their type
+        '''
+        value = self.db[name]
+        if isinstance(value, array) and not _fits(value.typecode, values):
+            self.db[name] = value.tolist()
+
+    def _index_rebuild(self):
+        '''Rebuild all secondary indexes with a single pass over db'''
+        for field in self._indexes:
+            self._indexes[field] = {}
+        if self._indexes:
+            for key, value in self.db.items():
+                self._index_insert(key, value)
+
+    def _index_entry(self, field, fvalue, key, add):
+        '''Add or discard key under fvalue in the index of field'''
+        index = self._indexes[field]
+        try:
+            if add:
+                index.setdefault(fvalue, set()).add(key)
+            else:
+                keys = index.get(fvalue)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[fvalue]
+        except TypeError:
+            pass  # unhashable field values are not indexed
+
+    def _index_insert(self, key, value):
+        '''Index the fields of a dict value stored under key'''
+        if self._indexes and isinstance(value, _DICT_TYPES):
+            for field in self._indexes:
+                if field in value:
+                    self._index_entry(field, value[field], key, True)
+
+    def _index_remove(self, key, value):
+        '''Drop the index entries of a dict value stored under key'''
+        if self._indexes and isinstance(value, _DICT_TYPES):
+            for field in self._indexes:
+                if field in value:
+                    self._index_entry(field, value[field], key, False)
+
+    def _touch(self, key):
+        '''Bump the version of key, or of every key if key is None
+
+        Versions are only kept for keys watched by a transaction.
+        '''
+        if key is None:
+            self._epoch += 1
+        elif key in self._watchers:
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def _propagate(self, command, key, encoded):
+        '''Publish a completed write, deferred until commit in a transaction
+
+        encoded is the call as sent to followers, None without followers.
+        '''
+        if not self._subscribers and not self._replicas:
+            return
+        write = (command, key, encoded)
+        if self._batched:
+            self._pending.append(write)
+        else:
+            self._publish([write])
+
+    def _flush(self):
+        '''Publish the writes of a committed transaction'''
+        pending, self._pending = self._pending, []
+        if pending:
+            self._publish(pending)
+
+    def _publish(self, writes):
+        '''Send writes to subscribers and, as one record, to all followers'''
+        for command, key, _ in writes:
+            self._notify(Event(command, key))
+        if self._replicas:
+            self._repl_offset += 1
+            data = b''.join(
+                [_array_header(4), _packb('cmd'), _packb(self._repl_offset),
+                 _packb(time.time()), _array_header(len(writes))] +
+                [encoded for _, _, encoded in writes])
+            for link in self._replicas:
+                link.push(data)
+
+    def _notify(self, event):
+        '''Deliver an event to all subscriptions matching its key'''
+        for sub in self._subscribers:
+            if sub._matches(event.key):
+                sub._deliver(event)
+
+    def subscribe(self, pattern='*', callback=None, maxlen=1024):
+        '''Subscribe to change events of keys matching a glob-style pattern
+
+        :Example:
+
+        >>> sub = db.subscribe('session:*')
+        >>> db.rem('session:1')
+        True
+        >>> sub.get(timeout=1)
+        Event(command='rem', key='session:1')
+        >>> db.subscribe('user:*', callback=print)
+        <thanosdb.thanosdb.Subscription object at 0x7f0c2a3b>
+
+        :param pattern: glob-style pattern of keys
+        :type pattern: string
+        :param callback: called with every event instead of queueing it
+        :type callback: callable
+        :param maxlen: maximum number of queued events before dropping the oldest
+        :type maxlen: int
+        :return: New subscription.
+        :rtype: Subscription
+        '''
+        sub = Subscription(self, pattern, callback, maxlen)
+        with self._lock:
+            self._subscribers = self._subscribers + [sub]
+        return sub
+
+    def unsubscribe(self, sub):
+        '''Remove a subscription returned by subscribe()
+
+        :param sub: Subscription to remove
+        :type sub: Subscription
+        :return: True if it was subscribed, else False.
+        :rtype: Boolean
+        '''
+        with self._lock:
+            if sub not in self._subscribers:
+                return False
+            self._subscribers = [s for s in self._subscribers if s is not sub]
+        return True
+
+    def serve_replication(self, address, maxlen=65536, interval=1.0):
+        '''Stream all writes to followers connecting to address
+
+        Each follower first receives a snapshot of db encoded like dump(),
+        then every write as it happens and a heartbeat every *interval*
+        seconds. A follower more than *maxlen* records behind is
+        disconnected and resyncs from a new snapshot when it reconnects.
 
         :Example:
 
-        >>> from thanosdb import thanosdb
-        >>> db = thanosdb.load('avengers.db', True, False)
-
-        :param location: location of msgpack database file
-        :type location: string
-        :param auto_dump: writes to disk after every operation
-        :type auto_dump: boolean
-        :param sig: used for graceful shutdown during dump
-        :type sig: boolean
+        >>> db.serve_replication('/tmp/avengers.sock')
+        True
+        >>> replica = thanosdb.follow('/tmp/avengers.sock')
+
+        :param address: unix socket path or (host, port) tuple to listen on
+        :type address: string, tuple
+        :param maxlen: maximum number of records queued per follower
+        :type maxlen: int
+        :param interval: seconds between heartbeats of an idle link
+        :type interval: float
+        :return: True
+        :rtype: Boolean
         '''
-        location = os.path.expanduser(location)
-        self.loco = location
-        self.auto_dump = auto_dump
-        if os.path.exists(location):
-            self._loaddb()
+        if isinstance(address, str):
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            if os.path.exists(address):
+                os.remove(address)
         else:
-            self.db = {}
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(address)
+        server.listen(16)
+        self._repl_server = server
+        Thread(target=self._repl_accept, args=(server, maxlen, interval),
+               daemon=True).start()
         return True
 
-    def dump(self):
+    def _repl_accept(self, server, maxlen, interval):
+        '''Accept followers and start a sender thread for each of them'''
+        while True:
+            try:
+                sock, _ = server.accept()
+            except OSError:
+                return
+            link = _ReplicaLink(self, sock, maxlen, interval)
+            with self._lock:
+                snapshot = _packb(
+                    ['sync', self._repl_offset, time.time(), _packb(self.db)])
+                self._replicas = self._replicas + [link]
+            Thread(target=link.run, args=(snapshot,), daemon=True).start()
+
+    def _replica_remove(self, link):
+        '''Forget a disconnected follower'''
+        with self._lock:
+            self._replicas = [l for l in self._replicas if l is not link]
+
+    def stop_replication(self):
+        '''Stop listening for followers and disconnect all of them
+
+        :return: True if replication was running, else False.
+        :rtype: Boolean
         '''
-        Force dump memory db to file.
+        if self._repl_server is None:
+            return False
+        self._repl_server.close()
+        self._repl_server = None
+        for link in self._replicas:
+            link.close()
+        return True
+
+    def _version(self, key):
+        '''Return the current version of key as seen by WATCH'''
+        return self._epoch, self._versions.get(key, 0)
+
+    def _watch(self, key):
+        '''Start tracking the version of key for a transaction and return it'''
+        with self._lock:
+            self._watchers[key] = self._watchers.get(key, 0) + 1
+            return self._version(key)
+
+    def _unwatch(self, keys):
+        '''Stop tracking keys for a transaction, dropping versions nobody watches'''
+        with self._lock:
+            for key in keys:
+                if self._watchers[key] > 1:
+                    self._watchers[key] -= 1
+                else:
+                    del self._watchers[key]
+                    self._versions.pop(key, None)
+
+    def _rollback(self, undo):
+        '''Restore the db state recorded by a failed transaction'''
+        for restore in reversed(undo):
+            if restore is not None:
+                restore()
+        self._keys = _SortedKeys(self.db)
+        self._index_rebuild()
+
+    def multi(self, *keys):
+        '''Start a transaction, optionally watching keys
 
         :Example:
 
-        >>> db.dump()
-        True
+        >>> tx = db.multi('snaps')
+        >>> tx.incr('snaps').set('snapped', True)
+        <thanosdb.thanosdb.Transaction object at 0x7f0c2a3b>
+        >>> tx.execute()
+        [1, True]
 
-        :return: True
-        :rtype: Boolean
+        :param keys: Names of keys to watch
+        :type keys: string
+        :return: New transaction.
+        :rtype: Transaction
         '''
-        msgpack.pack(self.db, open(self.loco, 'wb'))
-        self.dthread = Thread(
-            target=msgpack.pack,
-            args=(self.db, open(self.loco, 'wb')))
-        self.dthread.start()
-        self.dthread.join()
-        return True
+        tx = Transaction(self)
+        tx.watch(*keys)
+        return tx
 
-    def _loaddb(self):
-        '''Load or reload the msgpack info from the file'''
-        self.db = msgpack.unpack(open(self.loco, 'rb'), encoding='utf-8')
+    def transaction(self, func, *keys, retries=None):
+        '''Run func(tx) in a transaction watching keys, retrying on conflicts
+
+        func should read the watched keys from the db and queue its writes
+        on tx. It is called again whenever another writer modified a watched
+        key before the transaction could be applied.
+
+        :Example:
+
+        >>> def move(tx):
+        ...     hero = db.lget('avengers', 0)
+        ...     tx.lpop('avengers', 0).ladd('retired', hero)
+        >>> db.transaction(move, 'avengers')
+        ['Iron Man', True]
+
+        :param func: callable queueing operations on the transaction
+        :type func: callable
+        :param keys: Names of keys to watch
+        :type keys: string
+        :param retries: Maximum number of attempts, unlimited if None
+        :type retries: int
+        :return: List with the result of every queued operation.
+        :rtype: list
+        '''
+        attempt = 0
+        while True:
+            tx = self.multi(*keys)
+            try:
+                func(tx)
+            except BaseException:
+                tx.discard()
+                raise
+            try:
+                return tx.execute()
+            except WatchError:
+                attempt += 1
+                if retries is not None and attempt >= retries:
+                    raise
+
+    def publish_snapshot(self, path=None):
+        '''
+        Write an immutable snapshot of db for readers in other processes
+
+        Every value is encoded separately and an index of their offsets is
+        stored in front of them, so open_snapshot() can memory-map the file
+        and decode single keys. The new file is written next to the old one
+        and swapped in with an atomic rename; readers pick it up on refresh().
+
+        :Example:
+
+        >>> db.publish_snapshot()
+        1
+
+        :param path: location of the snapshot file, location of db with ".snap" appended if None
+        :type path: string
+        :return: Generation number of the new snapshot.
+        :rtype: int
+        '''
+        path = os.path.expanduser(path or self.loco + '.snap')
+        generation = 1
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                header = f.read(_SNAPSHOT_HEADER.size)
+            if len(header) == _SNAPSHOT_HEADER.size:
+                generation = _SNAPSHOT_HEADER.unpack(header)[2] + 1
+        index, values, offset = {}, [], 0
+        with self._lock:
+            for key, value in self.db.items():
+                data = _packb(value)
+                index[key] = (offset, len(data))
+                values.append(data)
+                offset += len(data)
+        index = _packb(index)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, 1, generation, len(index)))
+            f.write(index)
+            f.writelines(values)
+        os.replace(tmp, path)
+        return generation
 
     def _autodumpdb(self):
         '''Write/save the msgpack dump into the file if auto_dump is enabled'''
-        if self.auto_dump:
+        if self.auto_dump and not self._batched:
             self.dump()
 
+    @_write_command
     def set(self, key, value):
         '''Set the str value of a key
 
@@ -137,12 +2014,20 @@ class ThanosDB(object):
         :rtype: boolean
         '''
         if isinstance(key, str):
+            if key not in self.db:
+                self._keyindex_add(key)
+            else:
+                self._index_remove(key, self.db[key])
+            if self.compact:
+                value = self._compacted(value)
             self.db[key] = value
+            self._index_insert(key, value)
             self._autodumpdb()
             return True
         else:
             raise self.key_string_error
 
+    @_command
     def get(self, key):
         '''Get the value of a key
 
@@ -156,10 +2041,11 @@ class ThanosDB(object):
         :return: Value if key present else returns false.
         '''
         try:
-            return self.db[key]
+            return _plain(self.db[key])
         except KeyError:
             return False
 
+    @_command
     def getall(self):
         '''Return a list of all keys in db
 
@@ -173,6 +2059,99 @@ class ThanosDB(object):
         '''
         return self.db.keys()
 
+    @_command
+    def scan(self, cursor=0, match=None, count=10):
+        '''Incrementally iterate over the keys in db in sorted order
+
+        Start with cursor 0 and pass the returned cursor to the next call
+        until it comes back as 0. Keys added or removed between calls do not
+        break the iteration. A literal prefix in *match* is resolved through
+        the sorted key index, so only the matching range is visited.
+
+        :Example:
+
+        >>> db.scan(0, match='session:*', count=2)
+        ('session:2', ['session:1', 'session:2'])
+        >>> db.scan('session:2', match='session:*', count=2)
+        (0, ['session:3'])
+
+        :param cursor: 0 to start, else the cursor returned by the previous call
+        :type cursor: int, string
+        :param match: glob-style pattern keys have to match
+        :type match: string
+        :param count: Number of keys from the index visited in this call
+        :type count: int
+        :return: Tuple of next cursor and list of matching keys.
+        :rtype: tuple
+        '''
+        if count < 1:
+            raise ValueError('count must be at least 1.')
+        prefix = _literal_prefix(match) if match else ''
+        if cursor != 0 and cursor >= prefix:
+            batch = self._keys.after(cursor, count)
+        else:
+            batch = self._keys.after(prefix, count, inclusive=True)
+        found = []
+        for key in batch:
+            if not key.startswith(prefix):
+                return 0, found
+            if match is None or fnmatchcase(key, match):
+                found.append(key)
+        if len(batch) < count:
+            return 0, found
+        return batch[-1], found
+
+    def iter_range(self, start=None, stop=None, count=256):
+        '''Iterate over the keys in db with start <= key < stop in sorted order
+
+        Keys are read from the sorted key index *count* at a time, so the
+        full key list is never copied.
+
+        :Example:
+
+        >>> list(db.iter_range('b', 'i'))
+        ['black-widow', 'captain-america', 'hulk']
+
+        :param start: First key of the range, None for no lower bound
+        :type start: string
+        :param stop: Key the range stops before, None for no upper bound
+        :type stop: string
+        :param count: Number of keys read from the index at a time
+        :type count: int
+        :return: Generator of keys.
+        :rtype: generator
+        '''
+        if count < 1:
+            raise ValueError('count must be at least 1.')
+        batch = self._keys.after(start, count, inclusive=True)
+        while batch:
+            for key in batch:
+                if stop is not None and key >= stop:
+                    return
+                yield key
+            batch = self._keys.after(batch[-1], count)
+
+    def iter_prefix(self, prefix, count=256):
+        '''Iterate over the keys in db starting with prefix in sorted order
+
+        :Example:
+
+        >>> list(db.iter_prefix('session:'))
+        ['session:1', 'session:2', 'session:3']
+
+        :param prefix: Prefix of the keys
+        :type prefix: string
+        :param count: Number of keys read from the index at a time
+        :type count: int
+        :return: Generator of keys.
+        :rtype: generator
+        '''
+        for key in self.iter_range(prefix, count=count):
+            if not key.startswith(prefix):
+                return
+            yield key
+
+    @_command
     def exists(self, key):
         '''Return True if key exists in db, return False if not
 
@@ -188,6 +2167,7 @@ class ThanosDB(object):
         '''
         return key in self.db
 
+    @_conditional_write_command
     def rem(self, key):
         '''Delete a key
 
@@ -203,10 +2183,12 @@ class ThanosDB(object):
         '''
         if not key in self.db: # return False instead of an exception
             return False
-        del self.db[key]
+        self._index_remove(key, self.db.pop(key))
+        self._keyindex_rem(key)
         self._autodumpdb()
         return True
 
+    @_command
     def totalkeys(self, name=None):
         '''Get a total number of keys, lists, and dicts inside the db
         
@@ -227,6 +2209,7 @@ class ThanosDB(object):
             total = len(self.db[name])
             return total
 
+    @_write_command
     def append(self, key, more):
         '''Add more to a key's value
         
@@ -247,11 +2230,112 @@ class ThanosDB(object):
         :rtype: Boolean
         
         '''
-        tmp = self.db[key]
-        self.db[key] = tmp + more
+        value = _plain(self.db[key]) + more
+        self.db[key] = self._compacted(value) if self.compact else value
         self._autodumpdb()
         return True
 
+    def _incr(self, container, key, amount, types, error):
+        '''Add amount to the number stored under key in container'''
+        if type(amount) not in types:
+            raise error
+        with self._lock:
+            try:
+                value = container[key]
+            except KeyError:
+                value = 0
+            if type(value) not in types:
+                raise error
+            value += amount
+            container[key] = value
+        return value
+
+    def _incrkey(self, key, amount, types, error):
+        '''Add amount to the number stored under a top-level key'''
+        if not isinstance(key, str):
+            raise self.key_string_error
+        with self._lock:
+            created = key not in self.db
+            value = self._incr(self.db, key, amount, types, error)
+            if created:
+                self._keyindex_add(key)
+        self._autodumpdb()
+        return value
+
+    @_write_command
+    def incrby(self, key, amount=1):
+        '''Increment the integer value of a key by amount
+
+        A missing key is treated as 0. The read-modify-write happens under
+        the db lock and triggers a single dump.
+
+        :Example:
+
+        >>> db.incrby('snaps', 5)
+        5
+
+        :param key: Name of the key in db
+        :type key: string
+        :param amount: Integer to add, may be negative
+        :type amount: int
+        :return: Value after the increment.
+        :rtype: int
+        '''
+        return self._incrkey(key, amount, (int,), self.value_int_error)
+
+    @_write_command
+    def incr(self, key):
+        '''Increment the integer value of a key by one
+
+        :Example:
+
+        >>> db.incr('snaps')
+        6
+
+        :param key: Name of the key in db
+        :type key: string
+        :return: Value after the increment.
+        :rtype: int
+        '''
+        return self._incrkey(key, 1, (int,), self.value_int_error)
+
+    @_write_command
+    def decr(self, key):
+        '''Decrement the integer value of a key by one
+
+        :Example:
+
+        >>> db.decr('snaps')
+        5
+
+        :param key: Name of the key in db
+        :type key: string
+        :return: Value after the decrement.
+        :rtype: int
+        '''
+        return self._incrkey(key, -1, (int,), self.value_int_error)
+
+    @_write_command
+    def incrbyfloat(self, key, amount):
+        '''Increment the numeric value of a key by a float
+
+        :Example:
+
+        >>> db.incrbyfloat('power', 0.5)
+        0.5
+
+        :param key: Name of the key in db
+        :type key: string
+        :param amount: Number to add, may be negative
+        :type amount: float
+        :return: Value after the increment.
+        :rtype: float
+        '''
+        if type(amount) is int:
+            amount = float(amount)
+        return self._incrkey(key, amount, (int, float), self.value_float_error)
+
+    @_write_command
     def lcreate(self, name):
         '''Create an empty list with key name, name must be str
         
@@ -265,12 +2349,17 @@ class ThanosDB(object):
         :rtype: Boolean
         '''
         if isinstance(name, str):
-            self.db[name] = []
+            if name not in self.db:
+                self._keyindex_add(name)
+            else:
+                self._index_remove(name, self.db[name])
+            self.db[name] = _PackedList() if self.compact else []
             self._autodumpdb()
             return True
         else:
             raise self.key_string_error
 
+    @_write_command
     def ladd(self, name, value):
         '''Add a value to a list
         
@@ -287,13 +2376,16 @@ class ThanosDB(object):
         
         '''
         if self.exists(name):
+            self._writable(name, (value,))
             self.db[name].append(value)
+            self._recompact(name, (value,))
             self._autodumpdb()
         else:
             self.lcreate(name)
             self.ladd(name, value)
         return True
 
+    @_write_command
     def lextend(self, name, seq):
         '''Extend a list with a sequence
         
@@ -309,10 +2401,15 @@ class ThanosDB(object):
         :return: True if successful execution else false.
         :rtype: Boolean
         '''
+        if self.compact:
+            seq = list(seq)
+            self._writable(name, seq)
         self.db[name].extend(seq)
+        self._recompact(name, seq)
         self._autodumpdb()
         return True
 
+    @_command
     def lgetall(self, name):
         '''Return all values in a list
         
@@ -327,8 +2424,9 @@ class ThanosDB(object):
         :rtype: list
 
         '''
-        return self.db[name]
+        return _plain(self.db[name])
 
+    @_command
     def lget(self, name, pos):
         '''Return one value in a list
         
@@ -343,8 +2441,9 @@ class ThanosDB(object):
         :type pos: int
         :return: Value at index *pos* of list associated with key *name* in db.
         '''
-        return self.db[name][pos]
+        return _plain(self.db[name][pos])
 
+    @_write_command
     def lremlist(self, name):
         '''Remove a list and all of its values
         
@@ -359,10 +2458,12 @@ class ThanosDB(object):
         
         '''
         number = len(self.db[name])
-        del self.db[name]
+        self._index_remove(name, self.db.pop(name))
+        self._keyindex_rem(name)
         self._autodumpdb()
         return number
 
+    @_write_command
     def lremvalue(self, name, value):
         '''Remove a value from a certain list
         
@@ -383,6 +2484,7 @@ class ThanosDB(object):
         self._autodumpdb()
         return True
 
+    @_write_command
     def lpop(self, name, pos):
         '''Remove one value in a list
         
@@ -402,6 +2504,7 @@ class ThanosDB(object):
         self._autodumpdb()
         return value
 
+    @_command
     def llen(self, name):
         '''Returns the length of the list
         
@@ -417,6 +2520,7 @@ class ThanosDB(object):
         '''
         return len(self.db[name])
 
+    @_write_command
     def lappend(self, name, pos, more):
         '''Add more to a value in a list
         
@@ -434,11 +2538,14 @@ class ThanosDB(object):
         :rtype: Boolean
         
         '''
-        tmp = self.db[name][pos]
-        self.db[name][pos] = tmp + more
+        value = self.db[name][pos] + more
+        self._writable(name, (value,))
+        self.db[name][pos] = value
+        self._recompact(name, (value,))
         self._autodumpdb()
         return True
 
+    @_command
     def lexists(self, name, value):
         '''Determine if a value exists in a list
         
@@ -456,6 +2563,7 @@ class ThanosDB(object):
         '''
         return value in self.db[name]
 
+    @_write_command
     def dcreate(self, name):
         '''
         Create a dict, name must be str
@@ -471,12 +2579,17 @@ class ThanosDB(object):
         :rtype: Boolean
         '''
         if isinstance(name, str):
-            self.db[name] = {}
+            if name not in self.db:
+                self._keyindex_add(name)
+            else:
+                self._index_remove(name, self.db[name])
+            self.db[name] = _PackedDict() if self.compact else {}
             self._autodumpdb()
             return True
         else:
             raise self.key_string_error
 
+    @_write_command
     def dadd(self, name, pair):
         '''
         Add a key-value pair to a dict, "pair" is a tuple
@@ -499,13 +2612,62 @@ class ThanosDB(object):
         '''
         # import pdb; pdb.set_trace()
         if self.exists(name):
-            self.db[name][pair[0]] = pair[1]
+            field, value = pair[0], pair[1]
+            if field in self._indexes:
+                if field in self.db[name]:
+                    self._index_entry(field, self.db[name][field], name, False)
+                self._index_entry(field, value, name, True)
+            self.db[name][field] = value
+            self._recompact(name, (field, value))
             self._autodumpdb()
         else:
             self.dcreate(name)
             self.dadd(name, pair)
         return True
 
+    @_write_command
+    def dincrby(self, name, key, amount=1):
+        '''
+        Increment the integer value of a key in a dict by amount
+
+        The dict is created if it does not exist and a missing key is
+        treated as 0.
+
+        :Example:
+
+        >>> db.dincrby('stone-count', 'Vormir', 1)
+        1
+
+        :param name: Name of the key of dict in db
+        :type name: string
+        :param key: Name of key in dict
+        :type key: string
+        :param amount: Integer to add, may be negative
+        :type amount: int
+        :return: Value after the increment.
+        :rtype: int
+        :raises TypeError: if name holds no dict or key no integer
+        '''
+        if not isinstance(name, str):
+            raise self.key_string_error
+        with self._lock:
+            if name not in self.db:
+                self._keyindex_add(name)
+                self.db[name] = _PackedDict() if self.compact else {}
+            container = self.db[name]
+            if not isinstance(container, _DICT_TYPES):
+                raise self.value_dict_error
+            old = container.get(key)
+            value = self._incr(container, key, amount, (int,), self.value_int_error)
+            if key in self._indexes:
+                if old is not None:
+                    self._index_entry(key, old, name, False)
+                self._index_entry(key, value, name, True)
+            self._recompact(name, (key, value))
+        self._autodumpdb()
+        return value
+
+    @_command
     def dget(self, name, key):
         '''
         Return the value for a key in a dict
@@ -523,6 +2685,7 @@ class ThanosDB(object):
         '''
         return self.db[name][key]
 
+    @_command
     def dgetall(self, name):
         '''
         Return all key-value pairs from a dict
@@ -537,8 +2700,9 @@ class ThanosDB(object):
         :return: data stored in dict
         :rtype: dict
         '''
-        return self.db[name]
+        return _plain(self.db[name])
 
+    @_write_command
     def drem(self, name):
         '''
         Remove a dict and all of its pairs
@@ -553,10 +2717,12 @@ class ThanosDB(object):
         :return: True
         :rtype: Boolean
         '''
-        del self.db[name]
+        self._index_remove(name, self.db.pop(name))
+        self._keyindex_rem(name)
         self._autodumpdb()
         return True
 
+    @_write_command
     def dpop(self, name, key):
         '''
         Remove one key-value pair in a dict
@@ -575,9 +2741,12 @@ class ThanosDB(object):
         '''
         value = self.db[name][key]
         del self.db[name][key]
+        if key in self._indexes:
+            self._index_entry(key, value, name, False)
         self._autodumpdb()
         return value
 
+    @_command
     def dkeys(self, name):
         '''
         Return all the keys for a dict
@@ -592,8 +2761,9 @@ class ThanosDB(object):
         :return: dict_keys
         :rtype: dict_keys
         '''
-        return self.db[name].keys()
+        return _plain(self.db[name]).keys()
 
+    @_command
     def dvals(self, name):
         '''
         Return all the values for a dict
@@ -608,8 +2778,9 @@ class ThanosDB(object):
         :return: dict_values
         :rtype: dict_values
         '''
-        return self.db[name].values()
+        return _plain(self.db[name]).values()
 
+    @_command
     def dexists(self, name, key):
         '''
         Determine if a key exists or not in a dict
@@ -628,6 +2799,7 @@ class ThanosDB(object):
         '''
         return key in self.db[name]
 
+    @_write_command
     def dmerge(self, name1, name2):
         '''
         Merge two dicts together into name1
@@ -646,11 +2818,304 @@ class ThanosDB(object):
         :rtype: Boolean
         '''
         first = self.db[name1]
-        second = self.db[name2]
+        second = _plain(self.db[name2])
+        for field in self._indexes:
+            if field in second:
+                if field in first:
+                    self._index_entry(field, first[field], name1, False)
+                self._index_entry(field, second[field], name1, True)
         first.update(second)
+        self._recompact(name1, list(second.keys()) + list(second.values()))
+        self._autodumpdb()
+        return True
+
+    def _path_step(self, container, part, created=None):
+        '''Return the key or index of part in container, creating a
+        missing dict under it if created is a list, where it is recorded
+        '''
+        if isinstance(container, _LIST_TYPES):
+            return int(part)
+        if (part not in container and isinstance(part, str)
+                and part.lstrip('-').isdigit() and int(part) in container):
+            return int(part)
+        if created is not None and part not in container:
+            container[part] = {}
+            created.append((container, part))
+        return part
+
+    def _path_walk(self, parts, created=None):
+        '''Return the container holding the last segment of a path and its key'''
+        container = self.db
+        for part in parts[:-1]:
+            container = container[self._path_step(container, part, created)]
+        return container, self._path_step(container, parts[-1])
+
+    def _path_write(self, path, update):
+        '''Apply update(container, key) to the target of path, creating
+        missing dicts on the way, and keep the key indexes current. The
+        dicts created are removed again if update raises.
+        '''
+        parts = _path_parts(path)
+        top = parts[0]
+        created = top not in self.db
+        if not created:
+            self._index_remove(top, self.db[top])
+            if self.compact:
+                self.db[top] = _plain(self.db[top])
+        created_dicts = []
+        try:
+            container, key = self._path_walk(parts, created_dicts)
+            result = update(container, key)
+        except BaseException:
+            for container, part in reversed(created_dicts):
+                del container[part]
+            raise
+        finally:
+            if top in self.db:
+                if created:
+                    self._keyindex_add(top)
+                if self.compact:
+                    self.db[top] = self._compacted(self.db[top])
+                self._index_insert(top, self.db[top])
+            elif not created:
+                self._keyindex_rem(top)
         self._autodumpdb()
+        return result
+
+    @_command
+    def pget(self, path):
+        '''
+        Get the value at a path inside nested dicts and lists
+
+        The path is a dotted string or a list of segments, the first segment
+        is a key of db. Segments addressing a list are used as indexes.
+
+        :Example:
+
+        >>> db.pget('user.42.prefs.theme')
+        'dark'
+
+        :param path: Path to the value
+        :type path: string, list
+        :return: Value if the path exists else returns false.
+        '''
+        try:
+            container, key = self._path_walk(_path_parts(path))
+            return _plain(container[key])
+        except (KeyError, IndexError, TypeError, ValueError):
+            return False
+
+    @_write_command
+    def pset(self, path, value):
+        '''
+        Set the value at a path inside nested dicts and lists in place
+
+        Missing dicts on the way are created. Only the path and the value are
+        sent to followers, the rest of the document is not re-encoded.
+
+        :Example:
+
+        >>> db.pset('user.42.prefs.theme', 'dark')
+        True
+
+        :param path: Path to the value
+        :type path: string, list
+        :param value: Value to store at path
+        :return: True
+        :rtype: Boolean
+        '''
+        def update(container, key):
+            container[key] = value
+            return True
+        return self._path_write(path, update)
+
+    @_conditional_write_command
+    def pdel(self, path):
+        '''
+        Delete the value at a path inside nested dicts and lists
+
+        :Example:
+
+        >>> db.pdel('user.42.prefs.theme')
+        True
+
+        :param path: Path to the value
+        :type path: string, list
+        :return: True if the path existed and got deleted, else False.
+        :rtype: Boolean
+        '''
+        try:
+            self._path_walk(_path_parts(path))[0]
+        except (KeyError, IndexError, TypeError, ValueError):
+            return False
+
+        def update(container, key):
+            try:
+                del container[key]
+            except (KeyError, IndexError):
+                return False
+            return True
+        return self._path_write(path, update)
+
+    @_write_command
+    def pappend(self, path, value):
+        '''
+        Append to the list at a path, or add more to the string there
+
+        :Example:
+
+        >>> db.pappend('user.42.tags', 'avenger')
+        True
+
+        :param path: Path to a list or string
+        :type path: string, list
+        :param value: Item appended to the list, or string added to the string
+        :return: True
+        :rtype: Boolean
+        '''
+        def update(container, key):
+            if isinstance(container[key], _LIST_TYPES):
+                container[key].append(value)
+            else:
+                container[key] = container[key] + value
+            return True
+        return self._path_write(path, update)
+
+    @_write_command
+    def pincr(self, path, amount=1):
+        '''
+        Increment the number at a path, a missing value is treated as 0
+
+        :Example:
+
+        >>> db.pincr('user.42.visits')
+        1
+
+        :param path: Path to the number
+        :type path: string, list
+        :param amount: Number to add, may be negative
+        :type amount: int, float
+        :return: Value after the increment.
+        :rtype: int, float
+        '''
+        def update(container, key):
+            return self._incr(
+                container, key, amount, (int, float), self.value_float_error)
+        return self._path_write(path, update)
+
+    @_command
+    def memory_usage(self, key):
+        '''
+        Estimate the memory used by a key and the size of its encoding
+
+        :Example:
+
+        >>> db.memory_usage('avengers')
+        KeyUsage(key='avengers', type='list', length=4, size=489, encoded=41)
+
+        :param key: Name of key in db
+        :type key: string
+        :return: Type, length, deep size in memory and encoded size in bytes, false if key not present.
+        :rtype: KeyUsage
+        '''
+        if key not in self.db:
+            return False
+        value = self.db[key]
+        return _usage(key, value, len(_packb(value)))
+
+    @_command
+    def bigkeys(self, top=10, samples=None):
+        '''
+        Report the keys using the most memory, grouped by type of value
+
+        :Example:
+
+        >>> db.bigkeys(top=1)
+        {'list': [KeyUsage(key='avengers', type='list', length=4, size=489, encoded=41)],
+         'str': [KeyUsage(key='ironman', type='str', length=10, size=59, encoded=11)]}
+
+        :param top: Number of keys reported per type
+        :type top: int
+        :param samples: Number of randomly chosen keys to look at, all keys if None
+        :type samples: int
+        :return: Lists of KeyUsage by type name, largest first.
+        :rtype: dict
+        '''
+        keys = self._keys
+        if samples is not None and samples < len(keys):
+            keys = [keys[pos] for pos in random.sample(range(len(keys)), samples)]
+        db = self.db
+        return _bigkeys(
+            (_usage(key, db[key], len(_packb(db[key]))) for key in keys), top)
+
+    def create_index(self, field):
+        '''
+        Create a secondary index on a field of the dicts stored in db
+
+        The index is kept up to date by set, dadd, dpop, drem, dmerge and
+        friends, and rebuilt when the db file is loaded. Dicts changed in
+        place through the object returned by get() are not re-indexed.
+
+        :Example:
+
+        >>> db.create_index('status')
+        True
+
+        :param field: Name of the key in the dicts to index
+        :type field: string
+        :return: True if the index was created, False if it already exists.
+        :rtype: Boolean
+        '''
+        if field in self._indexes:
+            return False
+        self._indexes[field] = {}
+        for key, value in self.db.items():
+            if isinstance(value, _DICT_TYPES) and field in value:
+                self._index_entry(field, value[field], key, True)
         return True
 
+    def drop_index(self, field):
+        '''
+        Remove the secondary index on a field
+
+        :Example:
+
+        >>> db.drop_index('status')
+        True
+
+        :param field: Name of the indexed field
+        :type field: string
+        :return: True if the index existed, else False.
+        :rtype: Boolean
+        '''
+        return self._indexes.pop(field, None) is not None
+
+    @_command
+    def find(self, field, value):
+        '''
+        Return the keys of all dicts whose field equals value
+
+        :Example:
+
+        >>> db.dadd('ironman', ('status', 'retired'))
+        True
+        >>> db.find('status', 'retired')
+        ['ironman']
+
+        :param field: Name of the indexed field
+        :type field: string
+        :param value: Value of the field to look up
+        :return: List of keys in no particular order.
+        :rtype: list
+        '''
+        if field not in self._indexes:
+            raise KeyError('No index on field {!r}, use create_index().'.format(field))
+        try:
+            return list(self._indexes[field].get(value, ()))
+        except TypeError:
+            return []
+
+    @_write_command
     def deldb(self):
         '''
         Delete everything from the database
@@ -662,5 +3127,142 @@ class ThanosDB(object):
 
         '''
         self.db = {}
+        self._keys = _SortedKeys()
+        self._index_rebuild()
         self._autodumpdb()
         return True
+
+
+class Follower(ThanosDB):
+    '''
+    Read-only replica of a ThanosDB serving replication on address.
+
+    The follower loads the primary's snapshot, then applies its writes as
+    they arrive, so get(), lget(), dget() and the other reads can be served
+    from another thread or process. Subscriptions on a follower see the
+    replicated writes, plus a ``sync`` event whenever a new snapshot is loaded.
+    On disconnect, or when a record fails to apply, it reconnects every
+    *reconnect* seconds and resyncs.
+
+    :Example:
+
+    >>> replica = thanosdb.follow('/tmp/avengers.sock')
+    >>> replica.synced.wait(5)
+    True
+    >>> replica.get('ironman')
+    'Tony Stark'
+    >>> replica.lag()
+    0.0004
+
+    :param address: unix socket path or (host, port) tuple of the primary
+    :type address: string, tuple
+    :param reconnect: seconds to wait before reconnecting
+    :type reconnect: float
+    '''
+
+    read_only = True
+
+    def __init__(self, address, reconnect=1.0):
+        self._init_state()
+        self.loco = None
+        self.auto_dump = False
+        self.dthread = None
+        self.db = {}
+        self._keys = _SortedKeys()
+        self.address = address
+        self.reconnect = reconnect
+        self.offset = 0
+        self.primary_offset = 0
+        self.synced = ThreadEvent()
+        self._primary_time = None
+        self._sock = None
+        self._stopped = False
+        Thread(target=self._replicate, daemon=True).start()
+
+    def load(self, location, auto_dump):
+        '''Followers get their data from the primary only'''
+        raise self.read_only_error
+
+    def dump(self):
+        '''Followers have no file to dump to'''
+        raise self.read_only_error
+
+    def lag(self):
+        '''Return the replication lag in seconds
+
+        Measured from the primary's timestamp on the last record or heartbeat
+        received, so an idle, healthy link stays below the heartbeat interval.
+
+        :return: Lag in seconds, None before the first sync.
+        :rtype: float
+        '''
+        if self._primary_time is None:
+            return None
+        return max(0.0, time.time() - self._primary_time)
+
+    def close(self):
+        '''Stop replicating, the data received so far stays readable
+
+        :return: True
+        :rtype: Boolean
+        '''
+        self._stopped = True
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        return True
+
+    def _replicate(self):
+        '''Receive and apply records, reconnecting until closed'''
+        while not self._stopped:
+            try:
+                self._sock = _connect(self.address)
+                unpacker = _unpacker()
+                while not self._stopped:
+                    data = self._sock.recv(65536)
+                    if not data:
+                        break
+                    unpacker.feed(data)
+                    for record in unpacker:
+                        self._apply(record)
+            except OSError:
+                pass
+            except Exception:
+                # db no longer matches the primary, reconnect to resync it
+                _log.exception('Follower of %r failed to apply a record', self.address)
+                self._pending = []
+            finally:
+                if self._sock is not None:
+                    self._sock.close()
+            self.synced.clear()
+            if not self._stopped:
+                time.sleep(self.reconnect)
+
+    def _apply(self, record):
+        '''Apply one record received from the primary'''
+        kind, offset, timestamp = record[:3]
+        with self._lock:
+            if kind == 'sync':
+                self.db = _unpackb(record[3])
+                self._keys = _SortedKeys(self.db)
+                self._index_rebuild()
+                self._touch(None)
+                self._notify(Event('sync', None))
+            elif kind == 'cmd':
+                self.read_only = False
+                self._batched = True
+                try:
+                    for command, args, kwargs in record[3]:
+                        getattr(self, command)(*args, **kwargs)
+                finally:
+                    self._batched = False
+                    del self.read_only
+                self._flush()
+            if kind != 'ping':
+                self.offset = offset
+            self.primary_offset = offset
+            self._primary_time = timestamp
+        if kind == 'sync':
+            self.synced.set()